@@ -0,0 +1,120 @@
+from openai import OpenAI
+from typing import Callable, Iterator, Optional, Tuple
+import json
+import os
+import uuid
+
+TERMINAL_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+
+def write_batch_file(path: str, prompts: dict, model: str, max_token: int):
+    """
+    Writes one chat completion request per prompt in the JSONL format of the OpenAI Batch API.
+
+    :param path: Path of the batch file.
+    :param prompts: Dictionary of submission ID to rendered prompt. The ID becomes the request's custom_id.
+    :param model: The model name.
+    :param max_token: Maximum number of tokens to generate per request.
+    """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        for submission_id, prompt in prompts.items():
+            request = {
+                'custom_id': str(submission_id),
+                'method': 'POST',
+                'url': '/v1/chat/completions',
+                'body': {
+                    'model': model,
+                    'messages': [{'role': 'user', 'content': prompt}],
+                    'max_tokens': max_token,
+                },
+            }
+            f.write(json.dumps(request) + '\n')
+
+def parse_result_line(line: str) -> Tuple[str, Optional[str]]:
+    """
+    :param line: A line of a batch output file.
+    :return: The custom_id of the request and the response text, or None if the request failed.
+    """
+    result = json.loads(line)
+    response = result.get('response') or {}
+    if result.get('error') or response.get('status_code') != 200:
+        return result['custom_id'], None
+    return result['custom_id'], response['body']['choices'][0]['message']['content']
+
+class OpenAIBatchProvider:
+
+    def __init__(self, **kwargs):
+        """
+        Submits batch files to the OpenAI Batch API.
+
+        :param kwargs: Passed to the OpenAI client.
+        """
+        self.client = OpenAI(**kwargs)
+
+    def submit(self, path: str) -> str:
+        with open(path, 'rb') as f:
+            batch_file = self.client.files.create(file=f, purpose='batch')
+        batch = self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint='/v1/chat/completions',
+            completion_window='24h',
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        return self.client.batches.retrieve(batch_id).status
+
+    def results(self, batch_id: str) -> Iterator[Tuple[str, Optional[str]]]:
+        batch = self.client.batches.retrieve(batch_id)
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                for line in self.client.files.content(file_id).text.splitlines():
+                    if line.strip():
+                        yield parse_result_line(line)
+
+class LocalBatchProvider:
+
+    def __init__(self, respond: Callable[[str], str], directory: str = 'data/.cache/batches'):
+        """
+        File-based stand-in for the Batch API, for tests and offline runs. A submitted batch is
+        answered at once by calling `respond` on every prompt and writing an output file in the
+        format of the Batch API.
+
+        :param respond: Returns the response text of a prompt.
+        :param directory: Directory holding the output files.
+        """
+        self.respond = respond
+        self.directory = directory
+
+    def output_path(self, batch_id: str) -> str:
+        return os.path.join(self.directory, f"{batch_id}.output.jsonl")
+
+    def submit(self, path: str) -> str:
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        os.makedirs(self.directory, exist_ok=True)
+        with open(path, encoding='utf-8') as requests, open(self.output_path(batch_id), 'w', encoding='utf-8') as output:
+            for line in requests:
+                request = json.loads(line)
+                content = self.respond(request['body']['messages'][0]['content'])
+                result = {
+                    'custom_id': request['custom_id'],
+                    'response': {
+                        'status_code': 200,
+                        'body': {'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}}]},
+                    },
+                    'error': None,
+                }
+                output.write(json.dumps(result) + '\n')
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        return 'completed' if os.path.exists(self.output_path(batch_id)) else 'failed'
+
+    def results(self, batch_id: str) -> Iterator[Tuple[str, Optional[str]]]:
+        if not os.path.exists(self.output_path(batch_id)):
+            return  # A failed batch has no output, so every request of it is a failure
+        with open(self.output_path(batch_id), encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield parse_result_line(line)
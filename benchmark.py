@@ -0,0 +1,287 @@
+from feedback_generator_testing import QuizFeedbackGenerator
+from data_context import FeedbackDataContext
+from metrics import METRICS
+from utils import OpenAIChatResponse
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import shutil
+import threading
+import time
+import tracemalloc
+import pandas as pd
+
+QUESTION_TYPES = ['multiple_choice_question', 'true_false_question', 'multiple_answers_question', 'matching_question']
+
+def generate_tables(courses: int = 2, users: int = 50, quizzes: int = 10, questions: int = 10, choices: int = 4,
+                    graded_quizzes: int = None, seed: int = 0) -> dict:
+    """
+    Builds synthetic quiz tables with the schema of the four workbook sheets. Every user submits
+    every quiz of their course once. The earlier quizzes already have feedback and form the past
+    performance; the later ones are waiting for feedback.
+
+    :param courses: Number of courses.
+    :param users: Number of users per course.
+    :param quizzes: Number of quizzes per course, all due in the past.
+    :param questions: Number of questions per quiz.
+    :param choices: Number of answer choices per question.
+    :param graded_quizzes: Number of quizzes per course that already have feedback. Defaults to 70% of them.
+    :param seed: Seed of the random scores and answers.
+    :return: Dictionary of sheet name to DataFrame.
+    """
+    rng = random.Random(seed)
+    graded_quizzes = int(quizzes * 0.7) if graded_quizzes is None else graded_quizzes
+    start = datetime.now().replace(microsecond=0) - timedelta(days=7 * quizzes + 7)
+
+    quiz_rows, question_rows, answer_rows, past_rows = [], [], [], []
+    next_submission_id = 10_000_000
+    for course in range(courses):
+        course_id = 100_000 + course
+        for quiz in range(quizzes):
+            quiz_id = course_id * 1000 + quiz
+            due_date = start + timedelta(days=7 * quiz)
+            quiz_questions = []
+            for question in range(questions):
+                question_id = quiz_id * 100 + question
+                question_type = QUESTION_TYPES[question % len(QUESTION_TYPES)]
+                answer_ids = [question_id * 10 + choice for choice in range(choices)]
+                correct = rng.randrange(choices)
+                quiz_questions.append((question_id, answer_ids, correct))
+                for choice, answer_id in enumerate(answer_ids):
+                    question_rows.append({
+                        'quiz_id': quiz_id, 'course_id': course_id, 'question_id': question_id,
+                        'question_name': f"Question {question + 1}", 'question_type': question_type,
+                        'question_text': f"<p>Which statement about topic {question} of quiz {quiz} in course {course} is correct?</p>",
+                        'answer_id': answer_id, 'answer_text': f"Statement {choice + 1} about topic {question}",
+                        'weight': 100 if choice == correct else 0,
+                    })
+
+            for user in range(users):
+                user_id = 1_000_000 + course * users + user
+                submission_id = next_submission_id
+                next_submission_id += 1
+                score = 0
+                for question_id, answer_ids, correct in quiz_questions:
+                    choice = correct if rng.random() < 0.7 else rng.randrange(len(answer_ids))
+                    score += choice == correct
+                    answer_rows.append({'submission_id': submission_id, 'question_id': question_id, 'user_answer': answer_ids[choice]})
+
+                feedback = None
+                if quiz < graded_quizzes:
+                    feedback = (f"Feedback: Overall, you scored {score} out of {questions} on quiz {quiz + 1}.\n\n"
+                                f"Strengths:\n1. Solid grasp of most topics.\n\nAreas for Improvement:\n1. Review the missed topics.")
+                flags = {'attempt': 1, 'submission_dropped': 0, 'published': 1, 'visible_to_everyone': 1, 'quiz_dropped': 0}
+                quiz_rows.append({
+                    'quiz_id': quiz_id, 'user_id': user_id, 'submission_id': submission_id, 'course_id': course_id,
+                    'final_score': score, 'total_score': questions, 'due_at': due_date, **flags,
+                    'due_date': due_date, 'feedback': feedback,
+                })
+                past_rows.append({
+                    'user_id': user_id, 'quiz_id': quiz_id, 'course_id': course_id, **flags, 'unchecked_feedback': None,
+                    'total_score': questions, 'final_score': score, 'feedback': feedback, 'due_date': due_date,
+                })
+
+    df_quiz = pd.DataFrame(quiz_rows)
+    df_past_performance = pd.DataFrame(past_rows)[
+        ['user_id', 'quiz_id', 'course_id', 'attempt', 'published', 'visible_to_everyone', 'unchecked_feedback',
+         'submission_dropped', 'quiz_dropped', 'total_score', 'final_score', 'feedback', 'due_date']]
+    return {
+        'quiz_to_update': df_quiz,
+        'quiz_question_answers': pd.DataFrame(question_rows),
+        'quiz_user_answer': pd.DataFrame(answer_rows),
+        'quiz_user_past_performance': df_past_performance,
+    }
+
+def generate_workbook(path: str, **scale) -> str:
+    """
+    Writes a synthetic workbook with generate_tables. Workbooks are reused when one with the same
+    scale was already generated at the path.
+
+    :param path: Path of the workbook.
+    :param scale: Arguments of generate_tables.
+    :return: The path of the workbook.
+    """
+    marker = f"{path}.scale.json"
+    if os.path.exists(path) and os.path.exists(marker):
+        with open(marker, encoding='utf-8') as f:
+            if json.load(f) == scale:
+                return path
+
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tables = generate_tables(**scale)
+    with pd.ExcelWriter(path) as writer:
+        for sheet_name, df in tables.items():
+            df.to_excel(writer, sheet_name=sheet_name, index=False)
+    with open(marker, 'w', encoding='utf-8') as f:
+        json.dump(scale, f)
+    return path
+
+class FakeChatClient:
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, seed: int = 0):
+        """
+        Deterministic stand-in for the OpenAI client. A chat completion sleeps for the configured
+        latency and answers with a feedback text derived from the hash of the prompt, with a usage
+        field like the API's.
+
+        :param latency: Seconds each request takes.
+        :param jitter: Maximum extra seconds added to a request, drawn from a seeded generator.
+        :param seed: Seed of the jitter.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, messages: list, model: str, max_tokens: int, **kwargs):
+        prompt = messages[-1]['content']
+        with self.lock:
+            self.requests += 1
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        time.sleep(delay)
+
+        digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]
+        content = (f"Feedback: Overall, this is synthetic feedback {digest}.\n\n"
+                   f"Strengths:\n1. Consistent effort.\n\nAreas for Improvement:\n1. Review topic {int(digest, 16) % 10}.")
+        usage = SimpleNamespace(prompt_tokens=len(prompt) // 4, completion_tokens=len(content) // 4,
+                                total_tokens=len(prompt) // 4 + len(content) // 4)
+        message = SimpleNamespace(role='assistant', content=content)
+        return SimpleNamespace(choices=[SimpleNamespace(index=0, message=message)], usage=usage)
+
+def fake_chat_response(latency: float = 0.05, jitter: float = 0.0, seed: int = 0) -> OpenAIChatResponse:
+    """
+    :return: An OpenAIChatResponse whose requests go to a FakeChatClient, so that retries, caching
+        and metrics run as they do against the API.
+    """
+    openai = OpenAIChatResponse(api_key='benchmark')
+    openai.client = FakeChatClient(latency=latency, jitter=jitter, seed=seed)
+    return openai
+
+def run_workload(template: str, run_directory: str, mode: str, latency: float, max_workers: int, limit: int, seed: int) -> tuple:
+    """
+    Generates the feedback of every course of a copy of the workbook, without the cache or
+    changelog of earlier runs.
+
+    :return: The number of submissions updated and the fake chat client.
+    """
+    shutil.rmtree(run_directory, ignore_errors=True)
+    os.makedirs(run_directory)
+    file_name = os.path.join(run_directory, 'feedback_generator.xlsx')
+    shutil.copyfile(template, file_name)
+
+    openai = fake_chat_response(latency=latency, seed=seed)
+    context = FeedbackDataContext(file_name)
+    course_ids = sorted(context.df_quiz['course_id'].unique().tolist())
+    updated = 0
+    for course_id in course_ids:
+        if mode == 'course':
+            qfg = QuizFeedbackGenerator(course_id, context=context, openai=openai)
+            qfg.get_quiz_to_update(limit=limit)
+            if qfg.to_update_feedback_quizzes:
+                qfg.get_details_to_generate_feedback()
+                qfg.generate_feedback(max_workers=max_workers)
+                updated += len(qfg.to_update_feedback_quizzes)
+        elif mode == 'streaming':
+            qfg = QuizFeedbackGenerator(course_id, context=context, openai=openai)
+            updated += qfg.generate_feedback_streaming(limit=limit, max_workers=max_workers)
+        elif mode == 'user':
+            user_ids = context.course_quiz_rows(course_id)['user_id'].unique().tolist()
+            for user_id in user_ids:
+                qfg = QuizFeedbackGenerator(course_id, user_id=user_id, context=context, openai=openai)
+                qfg.get_quiz_to_update(limit=limit)
+                if qfg.to_update_feedback_quizzes:
+                    qfg.get_details_to_generate_feedback()
+                    qfg.generate_feedback(max_workers=max_workers)
+                    updated += len(qfg.to_update_feedback_quizzes)
+        else:
+            raise ValueError(f"Unknown benchmark mode: {mode}")
+    context.compact()
+    return updated, openai
+
+def run_benchmark(courses: int = 2, users: int = 50, quizzes: int = 10, questions: int = 10, choices: int = 4,
+                  latency: float = 0.05, max_workers: int = 8, mode: str = 'course', limit: int = None,
+                  directory: str = 'data/.cache/benchmark', seed: int = 0) -> dict:
+    """
+    Runs QuizFeedbackGenerator end to end on a synthetic workbook with a fake chat backend: loading,
+    querying, rendering, generating every pending feedback and saving. The workload runs twice: once
+    timed, and once with tracemalloc and no LLM latency for the peak memory.
+
+    :param courses: Number of courses in the workbook.
+    :param users: Number of users per course.
+    :param quizzes: Number of quizzes per course.
+    :param questions: Number of questions per quiz.
+    :param choices: Number of answer choices per question.
+    :param latency: Seconds each fake LLM request takes.
+    :param max_workers: Maximum number of LLM requests in flight at once.
+    :param mode: 'course' for generate_course_feedback, 'streaming' for generate_feedback_streaming,
+        or 'user' for one generator per user.
+    :param limit: Optional limit for the number of submissions per course.
+    :param directory: Directory of the generated workbooks.
+    :param seed: Seed of the synthetic data.
+    :return: Report with throughput, per-stage latency, peak memory and LLM counters.
+    """
+    scale = {'courses': courses, 'users': users, 'quizzes': quizzes, 'questions': questions, 'choices': choices, 'seed': seed}
+    name = 'workbook_' + '_'.join(str(value) for value in scale.values())
+    template = generate_workbook(os.path.join(directory, f"{name}.xlsx"), **scale)
+
+    # Timing and peak memory are measured in separate passes, as tracemalloc slows down allocations
+    METRICS.reset()
+    start = time.perf_counter()
+    updated, openai = run_workload(template, os.path.join(directory, 'run'), mode, latency, max_workers, limit, seed)
+    seconds = time.perf_counter() - start
+    metrics = METRICS.summary()
+
+    tracemalloc.start()
+    run_workload(template, os.path.join(directory, 'run'), mode, 0, max_workers, limit, seed)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    METRICS.reset()
+
+    return {
+        'scale': scale,
+        'mode': mode,
+        'latency': latency,
+        'max_workers': max_workers,
+        'submissions': updated,
+        'llm_requests': openai.client.requests,
+        'seconds': round(seconds, 3),
+        'submissions_per_second': round(updated / seconds, 2) if seconds else None,
+        'peak_memory_mb': round(peak / 2 ** 20, 1),
+        'stages': {
+            stage: {key: values[key] for key in ('count', 'seconds', 'mean_seconds', 'p95_seconds', 'rows')}
+            for stage, values in metrics['stages'].items()
+        },
+        'counters': metrics['counters'],
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark QuizFeedbackGenerator on synthetic data with a fake LLM backend.")
+    parser.add_argument('--courses', type=int, default=2)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--quizzes', type=int, default=10)
+    parser.add_argument('--questions', type=int, default=10)
+    parser.add_argument('--choices', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--max-workers', type=int, default=8)
+    parser.add_argument('--mode', choices=['course', 'streaming', 'user'], default='course')
+    parser.add_argument('--limit', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Also write the report to this JSON file.")
+    args = parser.parse_args()
+
+    METRICS.use_structured_logging(logging.getLogger('feedback.benchmark'))  # Progress is only logged at INFO, which is off by default
+    report = run_benchmark(courses=args.courses, users=args.users, quizzes=args.quizzes, questions=args.questions,
+                           choices=args.choices, latency=args.latency, max_workers=args.max_workers, mode=args.mode,
+                           limit=args.limit, seed=args.seed)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
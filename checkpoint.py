@@ -0,0 +1,74 @@
+from collections import Counter
+from datetime import datetime
+from storage import append_jsonl, open_jsonl, read_jsonl, to_json_value
+import os
+import threading
+import uuid
+
+class RunCheckpoint:
+
+    def __init__(self, run_id: str, directory: str = 'data/.checkpoints'):
+        """
+        Durable record of a feedback run: its parameters and the feedback of every submission
+        completed so far, appended and fsynced as each one finishes.
+
+        :param run_id: The ID of the run.
+        :param directory: Directory holding the checkpoint files.
+        """
+        self.run_id = run_id
+        self.path = os.path.join(directory, f"{run_id}.jsonl")
+        self.lock = threading.Lock()
+        self.params = {}
+        self.completed = {}
+        self.course_counts = Counter()
+        self.completed_courses = set()
+
+        for entry in read_jsonl(self.path):
+            if 'params' in entry:
+                self.params = entry['params']
+            elif 'completed_course' in entry:
+                self.completed_courses.add(entry['completed_course'])
+            else:
+                self.completed[entry['submission_id']] = entry['feedback']
+                self.course_counts[entry.get('course_id')] += 1
+
+    @classmethod
+    def create(cls, params: dict, run_id: str = None, directory: str = 'data/.checkpoints') -> 'RunCheckpoint':
+        """
+        Starts a new run and records its parameters.
+
+        :param params: Parameters needed to resume the run.
+        :param run_id: The ID of the run. Defaults to a new random ID.
+        :param directory: Directory holding the checkpoint files.
+        """
+        checkpoint = cls(run_id if run_id else uuid.uuid4().hex, directory)
+        if not checkpoint.params:
+            checkpoint.params = params
+            checkpoint.append({'params': params, 'created_at': datetime.now().isoformat()})
+        return checkpoint
+
+    def append(self, entry: dict):
+        with self.lock, open_jsonl(self.path) as f:
+            append_jsonl(f, [entry])
+
+    def record(self, submission_id, feedback, course_id = None):
+        """
+        Marks a submission as completed with its feedback.
+        """
+        submission_id = to_json_value(submission_id)
+        course_id = to_json_value(course_id)
+        self.append({'submission_id': submission_id, 'course_id': course_id, 'feedback': feedback})
+        with self.lock:
+            self.completed[submission_id] = feedback
+            self.course_counts[course_id] += 1
+
+    def complete_course(self, course_id):
+        """
+        Marks every submission of a course as done, so resuming the run skips the course.
+        """
+        course_id = to_json_value(course_id)
+        self.append({'completed_course': course_id})
+        self.completed_courses.add(course_id)
+
+    def is_completed(self, submission_id) -> bool:
+        return to_json_value(submission_id) in self.completed
@@ -0,0 +1,227 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from performance_summary import PerformanceSummary, is_eligible, wrong_question_types
+from storage import ExcelStorage
+from metrics import METRICS
+from schema import apply_schema, summarize_memory
+
+class FeedbackDataContext:
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, file_name: str = 'data/feedback_generator.xlsx', storage = None, compact_dtypes: bool = True):
+        """
+        Initializes the data context, loading the four quiz tables once so that many
+        generators can read them without keeping their own copies.
+
+        :param file_name: Path to the Excel workbook holding the quiz tables.
+        :param storage: Storage backend of the tables (ExcelStorage or SQLiteStorage). Defaults to the workbook.
+        :param compact_dtypes: Coerce the tables to the compact types of schema.SCHEMA on load.
+        """
+        self.file_name = file_name
+        self.storage = storage if storage is not None else ExcelStorage(self.file_name)
+        self.compact_dtypes = compact_dtypes
+        self.memory_report = None
+        self.lock = threading.RLock()
+        self.changes = {}
+
+        self.load()
+
+    @classmethod
+    def shared(cls, file_name: str = 'data/feedback_generator.xlsx') -> 'FeedbackDataContext':
+        """
+        Returns the context for the given workbook, creating it on first use.
+
+        :param file_name: Path to the Excel workbook holding the quiz tables.
+        :return: The process-wide context for the workbook.
+        """
+        key = os.path.abspath(file_name)
+        with cls._shared_lock:
+            if key not in cls._shared:
+                cls._shared[key] = cls(file_name)
+            return cls._shared[key]
+
+    def load(self):
+        with self.lock, METRICS.timer('load_file') as timer:
+            tables = self.storage.load()
+            if self.compact_dtypes:
+                tables, report = apply_schema(tables)
+                self.memory_report = summarize_memory(report)
+                METRICS.report(f"Compact dtypes: {self.memory_report['before_mb']} MB -> {self.memory_report['after_mb']} MB "
+                               f"({self.memory_report['saved_percent']}% saved)", event='compact_dtypes', **self.memory_report)
+            self.df_quiz = tables['quiz_to_update']
+            self.df_question_answer = tables['quiz_question_answers']
+            self.df_user_answer = tables['quiz_user_answer']
+            self.df_past_performance = tables['quiz_user_past_performance']
+            self.changes = {}
+            self.build_indexes()
+            self.performance_summary = PerformanceSummary.from_tables(
+                self.df_quiz, self.df_question_answer, self.df_user_answer, self.df_past_performance)
+
+            # Updates logged since the last compaction are applied again on top of the stored tables
+            for entry in self.storage.pending_updates():
+                self.apply_feedback(entry['submission_id'], entry['feedback'])
+            timer['rows'] = len(self.df_quiz)
+
+    def build_indexes(self):
+        """
+        Builds the row-position indexes used by the per-quiz lookups, so each lookup is a
+        dictionary access instead of a scan over the whole table.
+        """
+        self.quiz_index = group_positions(self.df_quiz, ['course_id', 'user_id'])
+        self.course_quiz_index = group_positions(self.df_quiz, ['course_id'])
+        self.submission_index = group_positions(self.df_quiz, ['submission_id'])
+        self.question_answer_index = group_positions(self.df_question_answer, ['course_id', 'quiz_id'])
+        self.user_answer_index = group_positions(self.df_user_answer, ['submission_id'])
+        self.past_feedback_index = group_positions(self.df_past_performance, ['quiz_id', 'user_id'])
+
+        # Rows of each (course_id, user_id) sorted by due_date, so the "due before" cut is a binary search
+        due_dates = self.df_past_performance['due_date'].values
+        order = np.argsort(due_dates, kind='stable')
+        self.past_performance_index = {
+            key: (order[positions], due_dates[order[positions]])
+            for key, positions in group_positions(self.df_past_performance.iloc[order], ['course_id', 'user_id']).items()
+        }
+
+    def quiz_rows(self, course_id, user_id) -> pd.DataFrame:
+        return take_rows(self.df_quiz, self.quiz_index.get((course_id, user_id)))
+
+    def course_quiz_rows(self, course_id) -> pd.DataFrame:
+        return take_rows(self.df_quiz, self.course_quiz_index.get(course_id))
+
+    def question_answer_rows(self, course_id, quiz_id) -> pd.DataFrame:
+        return take_rows(self.df_question_answer, self.question_answer_index.get((course_id, quiz_id)))
+
+    def user_answer_rows(self, submission_id) -> pd.DataFrame:
+        return take_rows(self.df_user_answer, self.user_answer_index.get(submission_id))
+
+    def past_performance_rows(self, course_id, user_id, due_before) -> pd.DataFrame:
+        """
+        :param course_id: The ID of the course.
+        :param user_id: The ID of the user.
+        :param due_before: Only rows with a due date strictly before this date are returned.
+        :return: Past performance rows of the user in the course, in table order.
+        """
+        entry = self.past_performance_index.get((course_id, user_id))
+        if entry is None:
+            return take_rows(self.df_past_performance, None)
+        positions, due_dates = entry
+        cut = np.searchsorted(due_dates, np.datetime64(pd.Timestamp(due_before)), side='left')
+        return take_rows(self.df_past_performance, np.sort(positions[:cut]))
+
+    def get_tables(self) -> dict:
+        return {
+            'quiz_to_update': self.df_quiz,
+            'quiz_question_answers': self.df_question_answer,
+            'quiz_user_answer': self.df_user_answer,
+            'quiz_user_past_performance': self.df_past_performance,
+        }
+
+    def update_feedback(self, submission_id, feedback):
+        """
+        Writes the feedback of a submission to the shared tables, records it in the change set
+        and persists it through the storage backend.
+
+        :param submission_id: The ID of the quiz submission.
+        :param feedback: The generated feedback.
+        """
+        with self.lock:
+            curr_quiz_id, curr_user_id = self.apply_feedback(submission_id, feedback)
+            self.storage.record_update(submission_id, curr_quiz_id, curr_user_id, feedback)
+
+    def merge_changes(self, changes: dict) -> int:
+        """
+        Writes the feedback of many submissions, e.g. the change set of a worker process, to the
+        shared tables and persists them through the storage backend in one batch.
+
+        :param changes: Dictionary of submission ID to feedback.
+        :return: Number of submissions merged.
+        """
+        with self.lock:
+            updates = []
+            for submission_id, feedback in changes.items():
+                curr_quiz_id, curr_user_id = self.apply_feedback(submission_id, feedback)
+                updates.append((submission_id, curr_quiz_id, curr_user_id, feedback))
+            if updates:
+                self.storage.record_updates(updates)
+            return len(updates)
+
+    def apply_feedback(self, submission_id, feedback) -> tuple:
+        """
+        Writes the feedback of a submission to the in-memory tables and the change set, and adds
+        the quiz to the user's performance summary.
+
+        :return: The quiz ID and user ID of the submission.
+        """
+        with self.lock:
+            positions = self.submission_index[submission_id]
+            self.df_quiz.iloc[positions, self.df_quiz.columns.get_loc('feedback')] = feedback
+            curr = self.df_quiz.iloc[positions]
+            curr_user_id = curr['user_id'].iloc[0]
+            curr_quiz_id = curr['quiz_id'].iloc[0]
+            past_positions = self.past_feedback_index.get((curr_quiz_id, curr_user_id))
+            if past_positions is not None:
+                self.df_past_performance.iloc[past_positions, self.df_past_performance.columns.get_loc('feedback')] = feedback
+                for row in self.df_past_performance.iloc[past_positions].to_dict(orient='records'):
+                    if is_eligible(row):
+                        wrong_types = wrong_question_types(
+                            self.question_answer_rows(row['course_id'], curr_quiz_id), self.user_answer_rows(submission_id))
+                        self.performance_summary.add(row['course_id'], curr_user_id, curr_quiz_id, row['due_date'],
+                                                     row['final_score'], row['total_score'], feedback, wrong_types)
+            self.changes[submission_id] = feedback
+            return curr_quiz_id, curr_user_id
+
+    def compact(self, force: bool = False) -> bool:
+        """
+        Merges the pending changes into the storage backend in one pass. For the workbook this
+        rewrites the sheets and the columnar cache and empties the changelog.
+
+        :param force: Save even when there are no pending changes.
+        :return: True if the data was saved.
+        """
+        with self.lock:
+            if not self.changes and not force:
+                return False
+            try:
+                with METRICS.timer('save_data') as timer:
+                    timer['rows'] = len(self.changes)
+                    self.storage.compact(self.get_tables())
+                self.changes = {}
+                return True
+            except Exception as e:
+                METRICS.report(f"Error occured when saving data to file: {self.file_name}\nError {e}", event='save_error', error=str(e))
+                return False
+
+def group_positions(df: pd.DataFrame, keys: list) -> dict:
+    """
+    Maps each key value to the row positions holding it, in table order.
+
+    :param df: DataFrame to index.
+    :param keys: Columns forming the key. A single column gives scalar keys, several give tuples.
+    :return: Dictionary of key to numpy array of row positions.
+    """
+    by = keys[0] if len(keys) == 1 else keys
+    return df.groupby(by, sort=False).indices
+
+def take_rows(df: pd.DataFrame, positions) -> pd.DataFrame:
+    if positions is None:
+        return df.iloc[:0]
+    return df.iloc[positions]
+
+def records_by(df: pd.DataFrame, key, columns: list = None) -> dict:
+    """
+    Converts a DataFrame to records once and groups them by a column.
+
+    :param df: DataFrame to convert.
+    :param key: Column, or list of columns, to group the records by.
+    :param columns: Columns to keep in the records. Defaults to all columns.
+    :return: Dictionary of key value to list of records, in table order.
+    """
+    records = (df if columns is None else df[columns]).to_dict(orient='records')
+    return {
+        value: [records[i] for i in positions]
+        for value, positions in df.groupby(key, sort=False).indices.items()
+    }
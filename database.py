@@ -1,56 +1,33 @@
 from pinecone import Pinecone
 import pandas as pd
-from openai import OpenAI
 import os
 from langchain_openai import OpenAIEmbeddings
+from utils import OpenAIChatResponse as BaseChatResponse
+from embedding_cache import EmbeddingCache
+from summary_store import SummaryStore
+from concurrent.futures import ThreadPoolExecutor
 # from lib.templates import QueryResponseTemplate
 
-class OpenAIChatResponse:
-    def __init__(self, **kwargs):
-        self.openai_api_key = os.environ.get("OPENAI_API_KEY")
-        self.client = OpenAI()
-    
+class OpenAIChatResponse(BaseChatResponse):
+    """
+    Chat client of the retrieval API. Shares the rate limiting and retry logic of utils.OpenAIChatResponse
+    and only changes the default model.
+    """
     def generate_response(self, query:str, model:str = "gpt-4o", max_token:int = 4000):
-        try:
-            chat_completion = self.client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "user",
-                        "content": query,
-                    }
-                ],
-                model=model,
-                max_tokens=max_token,
-            )
-            return chat_completion.choices[0].message.content
-        except:
-            print('Error generating response')
-            return None
+        return super().generate_response(query=query, model=model, max_token=max_token)
     
     def generate_summary(self, text:str, model:str = "gpt-4o", max_token:int = 4000):
-        query = f"""
-                    Please generate a detailed summary of the following text: {text}
-                """
-        try:
-            chat_completion = self.client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "user",
-                        "content": query,
-                    }
-                ],
-                model=model,
-                max_tokens=max_token,
-            )
-            return chat_completion.choices[0].message.content
-        except:
-            print('Error generating response')
-            return None
+        return super().generate_summary(text=text, model=model, max_token=max_token)
 
 class OpenAIEmbedder:
-    def __init__(self, model:str='text-embedding-ada-002', **kwargs):
+    def __init__(self, model:str='text-embedding-ada-002', cache: EmbeddingCache = None, **kwargs):
+        """
+        :param model: The embedding model.
+        :param cache: Optional EmbeddingCache. Texts found in it are not sent to the API again.
+        """
         self.model = model  # can also be text-embedding-3-large        
         self.openai_api_key = os.environ.get("OPENAI_API_KEY")
+        self.cache = cache
 
         self.embedder = OpenAIEmbeddings(
             model=self.model,  #'text-embedding-ada-002'
@@ -62,10 +39,31 @@ class OpenAIEmbedder:
         return self.embedder
     
     def embed_query(self, query_text:str):
-        return self.embedder.embed_query(query_text)
+        if self.cache is None:
+            return self.embedder.embed_query(query_text)
+        vector = self.cache.get(self.model, query_text)
+        if vector is None:
+            vector = self.embedder.embed_query(query_text)
+            self.cache.set(self.model, query_text, vector)
+        return vector
     
     def embed_documents(self, docs:list[str]):
-        return self.embedder.embed_documents(docs)
+        if self.cache is None:
+            return self.embedder.embed_documents(docs)
+
+        vectors = [self.cache.get(self.model, doc) for doc in docs]
+        missing = {}  # Each distinct missing text is embedded once
+        for index, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(docs[index], []).append(index)
+        if missing:
+            texts = list(missing)
+            embedded = self.embedder.embed_documents(texts)
+            self.cache.set_many(self.model, texts, embedded)
+            for text, vector in zip(texts, embedded):
+                for index in missing[text]:
+                    vectors[index] = vector
+        return vectors
     
 class PineConeAPI:
     def __init__(self, logger):
@@ -80,33 +78,164 @@ class PineConeAPI:
         
         self.pc = Pinecone(api_key=self.pinecone_api_key)
         self.index = self.pc.Index(self.index_name)
+        self.embedder = None
+        self.summary_store = None
     
-    def fetch_relevant_results(self, course_id:str, query:str,embedder = None, openai = None, filter:dict = {}, top_k:int = 3, summarized:bool = False, score_threshold:float = 0.5) -> pd.DataFrame:
-        embedder = OpenAIEmbedder() if embedder is None else embedder
+    def get_embedder(self) -> OpenAIEmbedder:
+        """
+        :return: The embedder shared by the calls that do not pass one, with a persistent embedding cache.
+        """
+        if self.embedder is None:
+            self.embedder = OpenAIEmbedder(cache=EmbeddingCache())
+        return self.embedder
+
+    def get_summary_store(self) -> SummaryStore:
+        """
+        :return: The store of chunk summaries, created on first use.
+        """
+        if self.summary_store is None:
+            self.summary_store = SummaryStore()
+        return self.summary_store
+
+    def summarize_texts(self, texts:list, openai = None, max_workers:int = 8, vector_ids:list = None) -> list:
+        """
+        Summarizes chunks of course material. Stored summaries are reused, and the remaining
+        distinct chunks are summarized concurrently and stored.
+
+        :param texts: The chunk texts.
+        :param openai: Chat client used to summarize.
+        :param max_workers: Maximum number of summaries generated at once.
+        :param vector_ids: Optional Pinecone vector IDs of the chunks, stored with their summaries.
+        :return: One summary per text, in order. None where summarization failed.
+        """
         openai = OpenAIChatResponse() if not openai else openai
+        store = self.get_summary_store()
+        summaries = store.get_many(texts)
+
+        missing = [text for text in dict.fromkeys(texts) if text not in summaries]
+        if missing:
+            ids = {}  # Several vectors can hold the same text
+            for text, vector_id in zip(texts, vector_ids or []):
+                ids.setdefault(text, []).append(vector_id)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for text, summary in zip(missing, executor.map(lambda text: openai.generate_summary(text=text), missing)):
+                    if summary is not None:
+                        store.set(text, summary, ids.get(text))
+                    summaries[text] = summary
+
+        return [summaries[text] for text in texts]
+
+    def precompute_summaries(self, course_id:str, openai = None, max_workers:int = 8, batch_size:int = 100) -> int:
+        """
+        Summarizes every chunk of a course namespace ahead of time, so that summarized retrieval
+        only reads stored summaries. Chunks that already have a summary are skipped.
+
+        :param course_id: The ID of the course, which is the namespace of its chunks.
+        :param openai: Chat client used to summarize.
+        :param max_workers: Maximum number of summaries generated at once.
+        :param batch_size: Number of vectors fetched per request.
+        :return: Number of chunks summarized.
+        """
+        store = self.get_summary_store()
+        summarized = 0
+        for page in self.index.list(namespace=str(course_id), limit=batch_size):
+            ids = [getattr(vector, 'id', vector) for vector in getattr(page, 'vectors', page)]
+            ids = [vector_id for vector_id in ids if not store.has_vector(vector_id)]
+            if not ids:
+                continue
+
+            vectors = self.index.fetch(ids=ids, namespace=str(course_id)).vectors
+            texts, text_ids = [], []
+            for vector_id, vector in vectors.items():
+                metadata = vector.metadata or {}
+                text = metadata.get('text') or metadata.get('Text')
+                if text:
+                    texts.append(text)
+                    text_ids.append(vector_id)
+
+            stored = store.get_many(texts)  # Same chunk text under another vector ID
+            summaries = self.summarize_texts(texts, openai=openai, max_workers=max_workers, vector_ids=text_ids)
+            for text, vector_id, summary in zip(texts, text_ids, summaries):
+                if summary is not None and text in stored:
+                    store.add_vectors(text, [vector_id])
+            summarized += sum(summary is not None for summary in dict(zip(texts, summaries)).values()) - len(stored)
+            self.logger.info(f"Summarized {summarized} chunks of course {course_id}")
+
+        return summarized
+
+    def query_index(self, course_id:str, vector:list, filter:dict = {}, top_k:int = 3, score_threshold:float = 0.5) -> pd.DataFrame:
+        """
+        Queries the course namespace with an embedding.
+
+        :return: Metadata of the matches above the score threshold, or None if there are no matches.
+        """
+        results = self.index.query(vector=vector, 
+                        namespace=str(course_id),
+                        filter=filter,
+                        top_k=top_k,
+                        include_metadata=True)
+
+        if results['matches']:
+            data = [match['metadata'] for match in results['matches'] if float(match['score']>=score_threshold)]
+            df = pd.DataFrame(data)
+            if 'Text' in df.columns:
+                # this command combines Text and text in the best way possible
+                df['text'] = df['Text'].combine_first(df['text'])
+            return df
+        else:
+            return None
+
+    def fetch_relevant_results(self, course_id:str, query:str,embedder = None, openai = None, filter:dict = {}, top_k:int = 3, summarized:bool = False, score_threshold:float = 0.5, max_workers:int = 8) -> pd.DataFrame:
+        embedder = self.get_embedder() if embedder is None else embedder
         try:
             vector = embedder.embed_query(query)
-            results = self.index.query(vector=vector, 
-                            namespace=str(course_id),
-                            filter=filter,
-                            top_k=top_k,
-                            include_metadata=True)
-
-            if results['matches']:
-                data = [match['metadata'] for match in results['matches'] if float(match['score']>=score_threshold)]
-                df = pd.DataFrame(data)
-                if 'Text' in df.columns:
-                    # this command combines Text and text in the best way possible
-                    df['text'] = df['Text'].combine_first(df['text'])
-                    
-                if summarized:
-                    df['text'] = df['text'].apply(lambda x: openai.generate_summary(text=x))
-                return df
-            else:
-                return None 
+            df = self.query_index(course_id, vector, filter=filter, top_k=top_k, score_threshold=score_threshold)
+
+            if df is not None and summarized:
+                df['text'] = self.summarize_texts(df['text'].tolist(), openai=openai, max_workers=max_workers)
+            return df
         except Exception as e:
             self.logger.error(f"Error occured during fetch relevant records during 'fetch_relevant_results': {e}")
 
+    def fetch_relevant_results_bulk(self, course_id:str, queries:list, embedder = None, openai = None, filter:dict = {}, top_k:int = 3, summarized:bool = False, score_threshold:float = 0.5, max_workers:int = 8) -> list:
+        """
+        Same as fetch_relevant_results for many queries: the queries are embedded with one
+        embed_documents call and the index is queried concurrently. With summarized, the chunks of
+        every query are then summarized together, so at most max_workers summaries are generated at once.
+
+        :param queries: The query texts.
+        :param max_workers: Maximum number of index queries, and of summaries, in flight at once.
+        :return: One DataFrame (or None) per query, in the order of the queries.
+        """
+        embedder = self.get_embedder() if embedder is None else embedder
+        try:
+            vectors = embedder.embed_documents(list(queries))
+        except Exception as e:
+            self.logger.error(f"Error occured during embedding queries in 'fetch_relevant_results_bulk': {e}")
+            return [None] * len(queries)
+
+        def fetch(vector):
+            try:
+                return self.query_index(course_id, vector, filter=filter, top_k=top_k, score_threshold=score_threshold)
+            except Exception as e:
+                self.logger.error(f"Error occured during fetch relevant records during 'fetch_relevant_results_bulk': {e}")
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(fetch, vectors))
+
+        if summarized:
+            # Queries whose matches all fall below score_threshold give a frame without a text column
+            retrieved = [df for df in results if df is not None and 'text' in df.columns]
+            texts = [text for df in retrieved for text in df['text']]
+            try:
+                summaries = iter(self.summarize_texts(texts, openai=openai, max_workers=max_workers))
+            except Exception as e:
+                self.logger.error(f"Error occured during summarizing records in 'fetch_relevant_results_bulk': {e}")
+                return [None] * len(queries)
+            for df in retrieved:
+                df['text'] = [next(summaries) for _ in range(len(df))]
+        return results
+
     def fetch_response(self, course_id:str, query:str, embedder = None, openai = None,filter:dict = {}, top_k:int = 3, evidence:bool = True) -> str:      
         openai = OpenAIChatResponse() if not openai else openai
         df = self.fetch_relevant_results(course_id=course_id,query=query, embedder=embedder, filter=filter, top_k=top_k)
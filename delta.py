@@ -0,0 +1,159 @@
+import numpy as np
+import os
+import sqlite3
+import threading
+import time
+import pandas as pd
+from storage import to_json_value
+
+def stable_values(series: pd.Series) -> pd.Series:
+    """
+    Converts a column to values that hash the same whatever its dtype (int64, nullable Int32, float64
+    with NaNs): numbers become float64, anything else strings.
+    """
+    numeric = pd.to_numeric(series, errors='coerce')
+    if numeric.isna().sum() == series.isna().sum():
+        return numeric.astype('float64')
+    return series.astype(str)
+
+def fingerprint_submissions(quizzes: pd.DataFrame, user_answers: pd.DataFrame) -> dict:
+    """
+    Fingerprints the inputs of the feedback of each submission: its scores and its answers. The
+    answer rows are hashed with pandas and combined per submission independently of their order.
+
+    :param quizzes: Quiz rows with submission_id, final_score and total_score columns.
+    :param user_answers: User answer rows of the submissions.
+    :return: Dictionary of submission ID to fingerprint.
+    """
+    if quizzes.empty:
+        return {}
+    answers = pd.DataFrame({
+        'submission_id': stable_values(user_answers['submission_id']),
+        'question_id': stable_values(user_answers['question_id']),
+        'user_answer': stable_values(user_answers['user_answer']),
+    })
+    answers['hash'] = pd.util.hash_pandas_object(answers[['question_id', 'user_answer']], index=False).to_numpy()
+    # Summed with wrap-around, so the order of the answer rows does not matter
+    answer_hashes = answers.groupby('submission_id')['hash'].agg(lambda hashes: np.add.reduce(hashes.to_numpy(), dtype=np.uint64))
+    answer_counts = answers.groupby('submission_id').size()
+
+    scores = pd.DataFrame({
+        'final_score': stable_values(quizzes['final_score']),
+        'total_score': stable_values(quizzes['total_score']),
+    })
+    score_hashes = pd.util.hash_pandas_object(scores, index=False).to_numpy()
+
+    fingerprints = {}
+    for submission_id, score_hash in zip(stable_values(quizzes['submission_id']), score_hashes):
+        answer_hash = int(answer_hashes.get(submission_id, 0))
+        count = int(answer_counts.get(submission_id, 0))
+        fingerprints[as_key(submission_id)] = f"{answer_hash:016x}{int(score_hash):016x}{count:x}"
+    return fingerprints
+
+def as_key(value):
+    """
+    Converts a float64 submission ID back to an int, the type it has in the tracker.
+    """
+    return int(value) if value == value and float(value).is_integer() else value
+
+class DeltaTracker:
+
+    def __init__(self, path: str = 'data/.cache/delta.sqlite'):
+        """
+        Change tracking of feedback runs, stored in a SQLite file: the fingerprint of the inputs of
+        every processed submission, the submissions a run could not finish, and a high-water mark per
+        course (the due date cutoff and the largest submission ID of its last complete run).
+
+        :param path: Path of the SQLite file.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS watermarks (
+                    course_id INTEGER PRIMARY KEY,
+                    due_date TEXT NOT NULL,
+                    submission_id INTEGER,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS fingerprints (
+                    submission_id INTEGER PRIMARY KEY,
+                    course_id INTEGER NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self.connection.execute("CREATE INDEX IF NOT EXISTS fingerprints_course ON fingerprints (course_id)")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS pending (
+                    submission_id INTEGER PRIMARY KEY,
+                    course_id INTEGER NOT NULL
+                )
+            """)
+
+    def watermark(self, course_id) -> tuple:
+        """
+        :return: The due date cutoff and the largest submission ID of the last run of the course, or (None, None).
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT due_date, submission_id FROM watermarks WHERE course_id = ?", (to_json_value(course_id),)).fetchone()
+        if row is None:
+            return None, None
+        return pd.Timestamp(row[0]), row[1]
+
+    def set_watermark(self, course_id, due_date, submission_id):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO watermarks (course_id, due_date, submission_id, updated_at) VALUES (?, ?, ?, ?)",
+                (to_json_value(course_id), pd.Timestamp(due_date).isoformat(), to_json_value(submission_id), time.time()))
+
+    def fingerprints(self, course_id) -> dict:
+        """
+        :return: Dictionary of submission ID to the fingerprint recorded when its feedback was generated.
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT submission_id, fingerprint FROM fingerprints WHERE course_id = ?", (to_json_value(course_id),)).fetchall()
+        return dict(rows)
+
+    def record_fingerprints(self, course_id, fingerprints: dict):
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO fingerprints (submission_id, course_id, fingerprint, updated_at) VALUES (?, ?, ?, ?)",
+                [(to_json_value(submission_id), to_json_value(course_id), fingerprint, now)
+                 for submission_id, fingerprint in fingerprints.items()])
+
+    def pending(self, course_id) -> set:
+        """
+        :return: Submissions selected by an earlier run that did not get feedback.
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT submission_id FROM pending WHERE course_id = ?", (to_json_value(course_id),)).fetchall()
+        return {row[0] for row in rows}
+
+    def set_pending(self, course_id, submission_ids: set):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM pending WHERE course_id = ?", (to_json_value(course_id),))
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO pending (submission_id, course_id) VALUES (?, ?)",
+                [(to_json_value(submission_id), to_json_value(course_id)) for submission_id in submission_ids])
+
+    def reset(self, course_id):
+        """
+        Forgets the course, so that its next run scans every submission again.
+        """
+        with self.lock, self.connection:
+            for table in ('watermarks', 'fingerprints', 'pending'):
+                self.connection.execute(f"DELETE FROM {table} WHERE course_id = ?", (to_json_value(course_id),))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,112 @@
+from collections import OrderedDict
+from typing import Optional
+import hashlib
+import numpy as np
+import os
+import sqlite3
+import threading
+import time
+
+def normalize_text(text: str) -> str:
+    """
+    Collapses runs of whitespace and strips the ends, so trivially different spellings of a query share an embedding.
+    """
+    return ' '.join(str(text).split())
+
+class EmbeddingCache:
+
+    def __init__(self, path: str = 'data/.cache/embeddings.sqlite', memory_entries: int = 4096):
+        """
+        Two-level cache of embeddings keyed by (model, normalized text): an in-memory LRU in front
+        of a SQLite file that keeps the vectors across runs as float32 blobs.
+
+        :param path: Path of the SQLite file. None keeps the cache in memory only.
+        :param memory_entries: Maximum number of vectors kept in memory.
+        """
+        self.path = path
+        self.memory_entries = memory_entries
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.connection = None
+        if path is not None:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    vector BLOB NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            self.connection.commit()
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        """
+        :return: SHA-256 of the model and the normalized text.
+        """
+        return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode('utf-8')).hexdigest()
+
+    def remember(self, key: str, vector: list):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def get(self, model: str, text: str) -> Optional[list]:
+        """
+        :return: The cached embedding, or None on a miss.
+        """
+        key = self.key(model, text)
+        with self.lock:
+            vector = self.memory.get(key)
+            if vector is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return vector
+            row = None
+            if self.connection is not None:
+                row = self.connection.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            vector = np.frombuffer(row[0], dtype=np.float32).tolist()
+            self.remember(key, vector)
+            self.hits += 1
+            return vector
+
+    def set_many(self, model: str, texts: list, vectors: list):
+        """
+        Stores the embeddings of many texts in one transaction.
+        """
+        now = time.time()
+        with self.lock:
+            rows = []
+            for text, vector in zip(texts, vectors):
+                key = self.key(model, text)
+                self.remember(key, vector)
+                rows.append((key, np.asarray(vector, dtype=np.float32).tobytes(), now))
+            if self.connection is not None:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, created_at) VALUES (?, ?, ?)", rows)
+                self.connection.commit()
+
+    def set(self, model: str, text: str, vector: list):
+        self.set_many(model, [text], [vector])
+
+    def stats(self) -> dict:
+        with self.lock:
+            stored = len(self.memory)
+            if self.connection is not None:
+                stored = self.connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            return {'hits': self.hits, 'misses': self.misses, 'in_memory': len(self.memory), 'entries': stored}
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
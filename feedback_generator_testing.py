@@ -1,68 +1,143 @@
-from template_detail import AutomatedFeedbackTemplate 
+from template_detail import AutomatedFeedbackTemplate, get_compiled_template
 from utils import OpenAIChatResponse
+from data_context import FeedbackDataContext, records_by
+from prompt_renderer import QuizPromptRenderer
+from token_budget import PromptBudget, summarize_token_usage
+from batch import OpenAIBatchProvider, TERMINAL_STATUSES, write_batch_file
+from pipeline import FeedbackPipeline
+from checkpoint import RunCheckpoint
+from metrics import METRICS
+from delta import DeltaTracker, fingerprint_submissions
 from pprint import pprint
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
+import os
+import time
 from datetime import datetime
 
 class QuizFeedbackGenerator():
-    def __init__(self, course_id, user_id, readonly: bool = False):
+    def __init__(self, course_id, user_id = None, readonly: bool = False, context: FeedbackDataContext = None, openai: OpenAIChatResponse = None, budget: PromptBudget = None):
         """
         Initializes the QuizFeedbackGenerator with a database connection and course ID.
         
         :param course_id: The ID of the course to fetch data for.
+        :param user_id: The ID of the user to fetch data for. If None, every user of the course is covered in one batch.
         :param readonly: Boolean flag to set the database connection to read-only mode.
+        :param context: Shared data context to read from. Defaults to the process-wide context of the workbook.
+        :param openai: Chat client used to generate feedback. Defaults to a new OpenAIChatResponse.
+        :param budget: Token budget policy for the prompts. Defaults to counting tokens without trimming.
         """
         super().__init__()
         self.course_id = course_id
         self.user_id = user_id
         
-        self.openai = OpenAIChatResponse()
+        self.openai = openai if openai is not None else OpenAIChatResponse()
         
         self.file_name = 'data/feedback_generator.xlsx'
-        self.load_file()
+        self.context = context if context is not None else FeedbackDataContext.shared(self.file_name)
+        self.renderer = QuizPromptRenderer()
+        self.budget = budget if budget is not None else PromptBudget()
+        self.max_token = 4000
+        self.compact_past_performance = True  # Summarize past quizzes instead of inlining their full feedback
+
+        self.prompt_tokens = {}
+        self.trimmed_prompts = []
+        self.failed_submissions = []  # Submissions of the last run whose feedback could not be generated
+        self.checkpoint = None  # RunCheckpoint of the current run, if any
 
         self.to_update_feedback_quizzes = None
         self.quiz_questions = None
         self.to_update_quiz_details = None
         self.users_past_performance = None
+        self.performance_summaries = {}  # Summary of each selected submission, as read at enrichment
+
+    @property
+    def df_quiz(self) -> pd.DataFrame:
+        return self.context.df_quiz
+
+    @property
+    def df_question_answer(self) -> pd.DataFrame:
+        return self.context.df_question_answer
+
+    @property
+    def df_user_answer(self) -> pd.DataFrame:
+        return self.context.df_user_answer
+
+    @property
+    def df_past_performance(self) -> pd.DataFrame:
+        return self.context.df_past_performance
     
     def save_data(self):
-        try:
-            with pd.ExcelWriter(path=self.file_name, engine='openpyxl') as writer:
-                self.df_quiz.to_excel(writer, sheet_name='quiz_to_update', index=False)
-                self.df_question_answer.to_excel(writer, sheet_name='quiz_question_answers', index=False)
-                self.df_user_answer.to_excel(writer, sheet_name='quiz_user_answer', index=False)
-                self.df_past_performance.to_excel(writer, sheet_name='quiz_user_past_performance', index=False)
-        except Exception as e:
-            print(f"Error occured when saving data to file: {self.file_name}")
-            print(f"Error {e}")
-
-    def __del__(self):
-        self.save_data()
+        """
+        Compacts the feedback changelog into the workbook. Updates are already durable in the
+        changelog, so this only needs to run at the end of a batch.
+        """
+        self.context.compact()
 
     def load_file(self):
-        self.df_quiz = pd.read_excel(self.file_name, sheet_name="quiz_to_update", engine='openpyxl')
-        self.df_question_answer = pd.read_excel(self.file_name, sheet_name="quiz_question_answers", engine='openpyxl')
-        self.df_user_answer = pd.read_excel(self.file_name, sheet_name="quiz_user_answer",  engine='openpyxl')
-        self.df_past_performance = pd.read_excel(self.file_name, sheet_name="quiz_user_past_performance",  engine='openpyxl')
+        """
+        Reloads the shared data context from the workbook.
+        """
+        self.context.load()
+
+    def get_tables(self) -> dict:
+        return self.context.get_tables()
 
     def update_feedback(self, submission_id, feedback):
-        self.df_quiz.loc[self.df_quiz['submission_id'] == submission_id, 'feedback'] = feedback
-        curr = self.df_quiz[self.df_quiz['submission_id'] == submission_id]
-        curr_user_id = curr['user_id'].iloc[0]
-        curr_quiz_id = curr['quiz_id'].iloc[0]
-        condition = (
-                        (self.df_past_performance['quiz_id'] == curr_quiz_id) & 
-                        (self.df_past_performance['user_id'] == curr_user_id)
-                    )
-        self.df_past_performance.loc[condition,'feedback'] = feedback
+        self.context.update_feedback(submission_id, feedback)
+        if self.checkpoint is not None and feedback is not None:
+            self.checkpoint.record(submission_id, feedback, self.course_id)
+
+    def apply_generated_feedback(self, submission_id, feedback) -> bool:
+        """
+        Persists a generated feedback. A failed generation (None) is not written, so the submission
+        keeps its current feedback and is selected again by the next run.
+
+        :param submission_id: The ID of the quiz submission.
+        :param feedback: The generated feedback, or None if generation failed.
+        :return: True if the feedback was written.
+        """
+        if feedback is None:
+            METRICS.increment('feedback_failures')
+            self.failed_submissions.append(submission_id)
+            return False
+        self.update_feedback(submission_id, feedback)
+        return True
+
+    def restore_checkpoint(self) -> int:
+        """
+        Writes the feedback recorded in the run checkpoint back to the tables, for submissions
+        whose feedback was lost with the process.
 
+        :return: Number of feedbacks restored.
+        """
+        restored = 0
+        for submission_id, feedback in self.checkpoint.completed.items():
+            positions = self.context.submission_index.get(submission_id)
+            if positions is None:
+                continue
+            if self.df_quiz['feedback'].iloc[positions].isnull().any():
+                self.context.update_feedback(submission_id, feedback)
+                restored += 1
+        return restored
+
+    @METRICS.timed('get_quiz_to_update_query')
     def get_quiz_to_update_query(self, limit: int = None) -> dict:
         """
             :param limit: Optional limit for the number of quizzes to fetch.
             :return: Filtered DataFrame
         """
-        df = self.df_quiz
+        if self.context.storage.pushdown:
+            if self.checkpoint is None:
+                return self.context.storage.quiz_to_update_query(self.course_id, self.user_id, datetime.now(), limit).to_dict(orient='records')
+            quizzes = self.context.storage.quiz_to_update_query(self.course_id, self.user_id, datetime.now(), None).to_dict(orient='records')
+            quizzes = [quiz for quiz in quizzes if not self.checkpoint.is_completed(quiz['submission_id'])]
+            return quizzes[:limit] if limit else quizzes
+
+        if self.user_id is None:
+            df = self.context.course_quiz_rows(self.course_id)  # Rows of every user in the course
+        else:
+            df = self.context.quiz_rows(self.course_id, self.user_id)  # Rows already matching course_id and user_id
 
         condition = (
             df['submission_id'].notna()  # Use .notna() to check for non-null values
@@ -71,53 +146,46 @@ class QuizFeedbackGenerator():
             & (df['quiz_dropped'] == 0)
             & (df['visible_to_everyone'] == 1)
             & (df['feedback'].isnull())
-            & (df['course_id'] == self.course_id)
-            & (df['user_id'] == self.user_id)
             & (df['due_date'] < datetime.now())
         )
 
-        filtered_data = df[condition] 
+        if self.checkpoint is not None:
+            condition &= ~df['submission_id'].isin(list(self.checkpoint.completed))  # Completed earlier in the run
+
+        filtered_data = df[condition.fillna(False)]  # Missing flags never match
 
         if limit:
             filtered_data = filtered_data[:limit]
     
         return filtered_data.to_dict(orient='records')
 
+    @METRICS.timed('get_question_answer_of_quiz_query')
     def get_question_answer_of_quiz_query(self, quiz_id: int) -> dict:
         """
         :param quiz_id: The ID of the quiz.
         :return: Filtered DataFrame
         """
-        df = self.df_question_answer
-
-        condition = (
-            (df['course_id'] == self.course_id)  
-          & (df['quiz_id'] == quiz_id)
-        )
-
-        return df[condition].to_dict(orient='records')
+        return self.context.question_answer_rows(self.course_id, quiz_id).to_dict(orient='records')
 
+    @METRICS.timed('get_user_answer_of_quiz_query')
     def get_user_answer_of_quiz_query(self, submission_id: int) -> dict:
         """
         :param submission_id: The ID of the quiz submission.
-        :return: SQL query string.
+        :return: Filtered Data is returned
         """
-        df = self.df_user_answer
-        
-        condition = (   
-                    df['submission_id'] == submission_id
-                )
-                
-        return df[condition].to_dict(orient='records')
+        return self.context.user_answer_rows(submission_id).to_dict(orient='records')
     
+    @METRICS.timed('get_past_performance_query')
     def get_past_performance_query(self, user_id: int, quiz_date: datetime, limit:int = 3) -> dict:
         """
         :param user_id: The ID of the user.
         :param quiz_date: The date of the current quiz.
         :return: Filtered Data is returned
         """
+        if self.context.storage.pushdown:
+            return self.context.storage.past_performance_query(self.course_id, user_id, quiz_date, limit).to_dict(orient='records')
 
-        df = self.df_past_performance
+        df = self.context.past_performance_rows(self.course_id, user_id, quiz_date)  # Rows of the user in the course due before quiz_date
 
         condition = (
                 (df['attempt'] == 1)
@@ -125,13 +193,10 @@ class QuizFeedbackGenerator():
                 & (df['visible_to_everyone'] == 1)
                 & (df['submission_dropped'] == 0)
                 & (df['quiz_dropped'] == 0)
-                & (df['course_id'] == self.course_id)
-                & (df['user_id'] == self.user_id)
-                & (df['due_date'] < quiz_date)
                 & (df['feedback'].notna())
             )
         
-        filtered_data = df[condition]
+        filtered_data = df[condition.fillna(False)]
 
         filtered_data = filtered_data.sort_values(by="due_date", ascending = False) ## Past quizzes should be descending in due date
 
@@ -140,6 +205,46 @@ class QuizFeedbackGenerator():
 
         return filtered_data.to_dict(orient='records')
 
+    @METRICS.timed('get_course_past_performance_query')
+    def get_course_past_performance_query(self, quizzes: pd.DataFrame, limit: int = 3) -> dict:
+        """
+        Fetches the past performance of many submissions at once, with the same filters as
+        get_past_performance_query applied to every (user, quiz date) pair in a single merge.
+
+        :param quizzes: DataFrame of submissions with user_id and due_date columns.
+        :param limit: Maximum number of past quizzes per submission.
+        :return: Dictionary of submission ID to past performance records, latest first.
+        """
+        df = self.df_past_performance
+
+        condition = (
+                (df['attempt'] == 1)
+                & (df['published'] == 1)
+                & (df['visible_to_everyone'] == 1)
+                & (df['submission_dropped'] == 0)
+                & (df['quiz_dropped'] == 0)
+                & (df['course_id'] == self.course_id)
+                & (df['user_id'].isin(quizzes['user_id'].unique()))
+                & (df['feedback'].notna())
+            )
+
+        candidates = df.loc[condition.fillna(False), ['user_id', 'due_date']].reset_index()
+        pairs = quizzes[['submission_id', 'user_id', 'due_date']].rename(columns={'due_date': 'quiz_date'})
+        pairs = pairs.merge(candidates, on='user_id')
+        pairs = pairs[pairs['due_date'] < pairs['quiz_date']]
+        pairs = pairs.sort_values(by='due_date', ascending=False, kind='stable')  ## Past quizzes should be descending in due date
+
+        if limit:
+            pairs = pairs.groupby('submission_id', sort=False).head(limit)
+
+        records = df.loc[pairs['index']].to_dict(orient='records')
+        past_performance = {}
+        for submission_id, record in zip(pairs['submission_id'], records):
+            past_performance.setdefault(submission_id, []).append(record)
+
+        return past_performance
+
+    @METRICS.timed('combine_questions_and_answers')
     def combine_questions_and_answers(self, question_answers: list, user_answers: list) -> list:
         """
         Combines question and answer data with user answers.
@@ -174,6 +279,46 @@ class QuizFeedbackGenerator():
 
         return result
 
+    @METRICS.timed('combine_questions_and_answers_batch')
+    def combine_questions_and_answers_batch(self, quizzes: pd.DataFrame, question_answers: pd.DataFrame, user_answers: pd.DataFrame) -> dict:
+        """
+        Combines questions, answer choices and user answers of a whole batch of submissions with merges.
+        Gives the same per-submission structure as combine_questions_and_answers; the answer choice
+        lists are built once per question and shared by every submission of the quiz.
+
+        :param quizzes: DataFrame of submissions with submission_id and quiz_id columns.
+        :param question_answers: Question and answer rows of the quizzes in the batch.
+        :param user_answers: User answer rows of the submissions in the batch.
+        :return: Dictionary of submission ID to combined list of questions with user answers.
+        """
+        answer_choices = records_by(question_answers, ['quiz_id', 'question_id'], columns=['answer_id', 'answer_text', 'weight'])
+        questions = question_answers.drop_duplicates(subset=['quiz_id', 'question_id'])[
+            ['quiz_id', 'question_id', 'question_name', 'question_type', 'question_text']]
+
+        # The last answer of a question wins, as with dict.update
+        answers = user_answers.drop_duplicates(subset=['submission_id', 'question_id'], keep='last').astype(object)
+        answers['answered'] = True
+        answer_columns = [column for column in user_answers.columns if column != 'question_id']
+
+        merged = quizzes[['submission_id', 'quiz_id']].merge(questions, on='quiz_id', how='inner')
+        merged = merged.merge(answers, on=['submission_id', 'question_id'], how='left')
+
+        result = {submission_id: [] for submission_id in quizzes['submission_id']}
+        for row in merged.to_dict(orient='records'):
+            question = {
+                'question_id': row['question_id'],
+                'question_name': row['question_name'],
+                'question_type': row['question_type'],
+                'question_text': row['question_text'],
+                'answer_choices': answer_choices[(row['quiz_id'], row['question_id'])],
+            }
+            if row['answered'] is True:
+                for column in answer_columns:
+                    question[column] = row[column]
+            result[row['submission_id']].append(question)
+
+        return result
+
     def get_quiz_to_update(self, limit: int = 1):
         """
         Fetches quizzes that need feedback and stores them in an instance variable.
@@ -190,9 +335,13 @@ class QuizFeedbackGenerator():
         if not self.to_update_feedback_quizzes:
             self.get_quiz_to_update()
 
+        if self.user_id is None:
+            return self.get_course_details_to_generate_feedback()
+
         self.quiz_questions = {}
         self.to_update_quiz_details = {}
         self.users_past_performance = {}
+        self.performance_summaries = {}
 
         for quiz in self.to_update_feedback_quizzes:
             quiz_id = quiz['quiz_id']
@@ -209,10 +358,98 @@ class QuizFeedbackGenerator():
                                                             self.quiz_questions[(self.course_id, quiz_id)], 
                                                             user_answers)
 
-            history_feedback_quizzes = self.get_past_performance_query(user_id, quiz_date)
+            if self.compact_past_performance:
+                history_feedback_quizzes = self.get_performance_digest(quiz)
+            else:
+                history_feedback_quizzes = self.get_past_performance_query(user_id, quiz_date)
 
             self.users_past_performance[submission_id] = history_feedback_quizzes
 
+    def get_course_details_to_generate_feedback(self):
+        """
+        Fetches the details of every selected submission of the course in one pass: question sets,
+        user answers and past performance are each gathered with a single filter and group-by.
+        """
+        self.quiz_questions = {}
+        self.performance_summaries = {}
+        self.to_update_quiz_details, self.users_past_performance = self.enrich_quizzes(self.to_update_feedback_quizzes)
+
+    def enrich_quizzes(self, quizzes: list) -> tuple:
+        """
+        Gathers the combined questions and the past performance of a batch of submissions of the course.
+
+        :param quizzes: List of submissions, as returned by get_quiz_to_update_query.
+        :return: Dictionaries of submission ID to combined questions and to past performance records.
+        """
+        return self.get_quiz_details(quizzes), self.get_past_performance(quizzes)
+
+    def get_quiz_details(self, quizzes: list) -> dict:
+        """
+        Combines the questions of a batch of submissions of the course with their user answers.
+
+        :param quizzes: List of submissions, as returned by get_quiz_to_update_query.
+        :return: Dictionary of submission ID to combined questions.
+        """
+        quizzes = pd.DataFrame(quizzes)
+        if quizzes.empty:
+            return {}
+
+        df = self.df_question_answer
+        question_answers = df[(df['course_id'] == self.course_id) & (df['quiz_id'].isin(quizzes['quiz_id'].unique()))]
+        if self.quiz_questions is not None:
+            for quiz_id, records in records_by(question_answers, 'quiz_id').items():
+                self.quiz_questions[(self.course_id, quiz_id)] = records
+
+        df = self.df_user_answer
+        user_answers = df[df['submission_id'].isin(quizzes['submission_id'])]
+
+        return self.combine_questions_and_answers_batch(quizzes, question_answers, user_answers)
+
+    def get_past_performance(self, quizzes: list) -> dict:
+        """
+        Reads the past performance of a batch of submissions of the course. The tables and the
+        performance summary are read under the context lock, as feedback written meanwhile updates them.
+
+        :param quizzes: List of submissions, as returned by get_quiz_to_update_query.
+        :return: Dictionary of submission ID to past performance records (digests with compact_past_performance).
+        """
+        quizzes = pd.DataFrame(quizzes)
+        if quizzes.empty:
+            return {}
+
+        with self.context.lock:
+            if self.compact_past_performance:
+                return {quiz['submission_id']: self.get_performance_digest(quiz) for quiz in quizzes.to_dict(orient='records')}
+            return self.get_course_past_performance_query(quizzes)
+
+    def get_performance_summary(self, quiz: dict) -> dict:
+        """
+        Reads the performance summary of a submission's user once and keeps it, so every render of
+        the submission's prompt uses the summary as it was when the submission was enriched.
+
+        :param quiz: Dictionary containing current quiz data.
+        :return: The summary, or None if the user has no past quizzes with feedback.
+        """
+        submission_id = quiz['submission_id']
+        if submission_id not in self.performance_summaries:
+            with self.context.lock:
+                self.performance_summaries[submission_id] = self.context.performance_summary.summarize(
+                    quiz['course_id'], quiz['user_id'], quiz['due_date'])
+        return self.performance_summaries[submission_id]
+
+    def get_performance_digest(self, quiz: dict) -> list:
+        """
+        Reads the recent feedback digests of the user's performance summary, used in place of the
+        past quiz records when compact_past_performance is on.
+
+        :param quiz: Dictionary containing current quiz data.
+        :return: Records with due_date and feedback (the digest), latest first.
+        """
+        summary = self.get_performance_summary(quiz)
+        if not summary:
+            return []
+        return [{'due_date': due_date, 'feedback': digest} for due_date, digest in reversed(summary['recent_feedback'])]
+
     def generate_past_performance_template(self, data: dict, id: int) -> str:
         """
         Generates a template for past performance feedback.
@@ -221,28 +458,7 @@ class QuizFeedbackGenerator():
         :param id: The submission ID.
         :return: Formatted past performance string.
         """
-        if not data.get(id, False):
-            return "Past Performance: Not Available."
-        
-        past_performance_template = """ 
-                Past Performance: 
-            """ 
-        for index, quiz in enumerate(data[id]):
-            quiz_id = quiz['quiz_id']
-            quiz_date = str(quiz['due_date']) if quiz['due_date'] else "N/A"
-            score = quiz['final_score'] if quiz['final_score'] else "N/A"
-            total_score = quiz['total_score'] if quiz['total_score'] else "N/A"
-            feedback = quiz['feedback']
-            
-            past_quiz_template = f""" 
-                                    Quiz {index + 1}
-                                    Past Quiz Date: {quiz_date}
-                                    Past Score: {score} / {total_score}
-                                    Past Feedback: {feedback}
-                                """
-            past_performance_template += past_quiz_template
-        
-        return past_performance_template
+        return self.renderer.render_past_performance(data.get(id))
     
     def generate_current_quiz_template(self, quiz: dict, quiz_details: dict) -> str:
         """
@@ -252,82 +468,402 @@ class QuizFeedbackGenerator():
         :param quiz_details: Dictionary containing current quiz details.
         :return: Formatted current quiz string.
         """
-        quiz_date = str(quiz['due_date']) if quiz['due_date'] else "N/A"
-        quiz_id = quiz['quiz_id']
-        submission_id = quiz['submission_id']
-        score = quiz['final_score']
-        total_score = quiz['total_score']
-
-        Current_Quiz_Template = f"""
-            Current Quiz Details: \
-            Quiz Date: {quiz_date} \
-            Quiz Id: {quiz_id} \
-            Score: {score} / {total_score} \
-            """
-        
-        for question in quiz_details[submission_id]:
-            question_id = question['question_id']
-            question_name = question['question_name']
-            question_text = question['question_text']
+        return self.renderer.render_current_quiz(quiz, quiz_details[quiz['submission_id']])
+    
+    @METRICS.timed('render', count_rows=False)
+    def render_prompt(self, quiz: dict, questions: list, past_quizzes: list, renderer: QuizPromptRenderer = None) -> str:
+        """
+        Renders the feedback prompt of a submission from its questions and past quizzes.
 
-            question_template = f""" 
-            {question_id} | {question_name} : {question_text} \
-            """
+        :param quiz: Dictionary containing current quiz data.
+        :param questions: Combined list of questions with user answers of the submission.
+        :param past_quizzes: Past quiz records of the user, latest first. With compact_past_performance, the
+            feedback digests of get_performance_digest, which replace the digests of the summary.
+        :param renderer: Renderer to use. Defaults to the generator's renderer with its question cache.
+        :return: The rendered prompt.
+        """
+        renderer = renderer if renderer is not None else self.renderer
+        if self.compact_past_performance:
+            summary = self.get_performance_summary(quiz)
+            if summary:
+                summary = dict(summary, recent_feedback=[(past['due_date'], past['feedback']) for past in reversed(past_quizzes or [])])
+            past_performance = renderer.render_performance_summary(summary)
+        else:
+            past_performance = renderer.render_past_performance(past_quizzes)
+        input = {
+                'current_quiz' : renderer.render_current_quiz(quiz, questions), 
+                'past_performance' : past_performance
+            }
+        return get_compiled_template(AutomatedFeedbackTemplate).render(**input)
+
+    def build_prompts(self) -> dict:
+        """
+        Renders the feedback prompt of every selected submission, counting its tokens and trimming
+        it to the token budget if needed.
 
-            Current_Quiz_Template += question_template
+        :return: Dictionary of submission ID to rendered prompt.
+        """
+        if not self.to_update_feedback_quizzes or not self.to_update_quiz_details:
+            self.get_details_to_generate_feedback()
 
-            for index, answer in enumerate(question['answer_choices']):
-                answer_id = answer['answer_id']
-                answer_text = answer['answer_text']
-                weight = answer['weight']
+        prompts = {}
+        self.prompt_tokens = {}
+        self.trimmed_prompts = []
 
-                answer_template = f""" 
-                    {index + 1} | Id: {answer_id} | Text: {answer_text} | Weight: {weight} \
-                """
+        for quiz in self.to_update_feedback_quizzes:
+            submission_id = quiz['submission_id']
+            prompts[submission_id] = self.build_prompt(quiz, self.to_update_quiz_details[submission_id],
+                                                       self.users_past_performance.get(submission_id))
 
-                Current_Quiz_Template += answer_template
-        
-            student_choice_template = f"""
-                Student's Choice Id : {question.get('user_answer', 'Not Attempted')}
-            """
-            Current_Quiz_Template += student_choice_template
+        return prompts
 
-        return Current_Quiz_Template
-    
-    def generate_feedback(self) -> dict:
+    def build_prompt(self, quiz: dict, questions: list, past_quizzes: list) -> str:
+        """
+        Renders the feedback prompt of a submission, recording its token count and trimming it
+        to the token budget if needed.
+
+        :param quiz: Dictionary containing current quiz data.
+        :param questions: Combined list of questions with user answers of the submission.
+        :param past_quizzes: Past quiz records of the user, latest first.
+        :return: The rendered prompt.
+        """
+        prompt = self.render_prompt(quiz, questions, past_quizzes)
+        # Trimmed inputs are rendered without the question cache, which holds the full texts
+        prompt, tokens, trimmed = self.budget.fit(
+            prompt, questions, past_quizzes,
+            lambda questions, past_quizzes: self.render_prompt(quiz, questions, past_quizzes, QuizPromptRenderer()))
+
+        self.prompt_tokens[quiz['submission_id']] = tokens
+        if trimmed:
+            self.trimmed_prompts.append(quiz['submission_id'])
+
+        return prompt
+
+    def token_report(self) -> dict:
+        """
+        :return: Token totals of the prompts of the last batch, to forecast its cost and latency.
+        """
+        return summarize_token_usage(self.prompt_tokens, self.trimmed_prompts, self.max_token, self.budget.max_prompt_tokens)
+
+    def generate_feedback(self, max_workers: int = 1) -> dict:
         """
         Generates feedback for quizzes and updates the database.
 
+        :param max_workers: Maximum number of LLM requests in flight at once. 1 sends them one at a time.
         :return: Dictionary containing the number of quizzes updated.
         """
-        if not self.to_update_feedback_quizzes or not self.to_update_quiz_details:
-            self.get_details_to_generate_feedback()
+        prompts = self.build_prompts()
+        report = self.token_report()
+        METRICS.report(f"Token usage: {report}", event='token_usage', **report)
         
         updated = 0
-
-        for quiz in self.to_update_feedback_quizzes:
-            submission_id = quiz['submission_id']
-            print(f"**************** - updated_submission_id {submission_id} - *****************")
-            Current_Quiz_Template = self.generate_current_quiz_template(quiz, self.to_update_quiz_details)
-            Past_Performance_Template = self.generate_past_performance_template(self.users_past_performance, submission_id)
-
-            feedback_template = AutomatedFeedbackTemplate()
-            prompt, _, _ = feedback_template.build()
-            input = {
-                    'current_quiz' : Current_Quiz_Template, 
-                    'past_performance' : Past_Performance_Template
+        feedback = None
+        self.failed_submissions = []
+
+        if max_workers > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    executor.submit(self.openai.generate_response, query=prompt, max_token=self.max_token): submission_id
+                    for submission_id, prompt in prompts.items()
                 }
-            feedback = self.openai.generate_response(query=prompt.format(**input))
+                for future in as_completed(futures):
+                    submission_id = futures[future]
+                    feedback = future.result()
+                    METRICS.report(f"**************** - updated_submission_id {submission_id} - *****************\n{feedback}",
+                                   event='feedback_generated', submission_id=submission_id, generated=feedback is not None)
+
+                    updated += self.apply_generated_feedback(submission_id, feedback)
 
-            # print(Current_Quiz_Template)
-            # print(Past_Performance_Template)
-            print(feedback)
+            return feedback
+
+        for submission_id, prompt in prompts.items():
+            feedback = self.openai.generate_response(query=prompt, max_token=self.max_token)
+
+            METRICS.report(f"**************** - updated_submission_id {submission_id} - *****************\n{feedback}",
+                           event='feedback_generated', submission_id=submission_id, generated=feedback is not None)
             
-            self.update_feedback(submission_id,feedback)
-            updated += 1
+            updated += self.apply_generated_feedback(submission_id, feedback)
         
         return feedback
 
+    def generate_feedback_batch(self, provider = None, batch_file: str = 'data/batch_requests.jsonl', model: str = "gpt-3.5-turbo", poll_interval: float = 60,
+                                max_wait: float = 24 * 3600) -> int:
+        """
+        Generates feedback through a batch API instead of one request per submission. All prompts are
+        written to a JSONL batch file keyed by submission ID, submitted, polled until the batch finishes,
+        and the results are applied through update_feedback as they are read.
+
+        :param provider: Batch provider (OpenAIBatchProvider or LocalBatchProvider). Defaults to OpenAIBatchProvider.
+        :param batch_file: Path the batch file is written to.
+        :param model: The model name.
+        :param poll_interval: Seconds between status checks.
+        :param max_wait: Seconds to wait for the batch to finish. A batch still running then is left
+            alone and its submissions stay without feedback, for a later run to pick up.
+        :return: Number of quizzes updated.
+        """
+        provider = provider if provider is not None else OpenAIBatchProvider()
+        self.failed_submissions = []
+        prompts = self.build_prompts()
+        report = self.token_report()
+        METRICS.report(f"Token usage: {report}", event='token_usage', **report)
+        if not prompts:
+            return 0
+
+        submission_ids = {str(submission_id): submission_id for submission_id in prompts}
+        write_batch_file(batch_file, prompts, model, self.max_token)
+        batch_id = provider.submit(batch_file)
+        METRICS.report(f"Submitted batch {batch_id} with {len(prompts)} requests", event='batch_submitted', batch_id=batch_id, requests=len(prompts))
+
+        deadline = time.monotonic() + max_wait
+        status = provider.status(batch_id)
+        while status not in TERMINAL_STATUSES:
+            if time.monotonic() >= deadline:
+                self.failed_submissions.extend(submission_ids.values())
+                METRICS.report(f"Batch {batch_id} did not finish within {max_wait} seconds, status {status}; its submissions stay pending",
+                               event='batch_timeout', batch_id=batch_id, status=status)
+                return 0
+            time.sleep(min(poll_interval, max(0.0, deadline - time.monotonic())))
+            status = provider.status(batch_id)
+        METRICS.report(f"Batch {batch_id} finished with status {status}", event='batch_finished', batch_id=batch_id, status=status)
+
+        updated = 0
+        for custom_id, feedback in provider.results(batch_id):
+            if custom_id in submission_ids:
+                updated += self.apply_generated_feedback(submission_ids.pop(custom_id), feedback)
+        self.failed_submissions.extend(submission_ids.values())  # Requests the batch returned no result for
+
+        return updated
+
+    def generate_feedback_streaming(self, limit: int = None, max_workers: int = 4, chunk_size: int = 50) -> int:
+        """
+        Generates feedback with a streaming pipeline: submissions are enriched and rendered in chunks
+        while earlier ones are being generated, and each feedback is persisted as soon as it arrives.
+
+        :param limit: Optional limit for the number of submissions to process.
+        :param max_workers: Number of LLM requests in flight at once.
+        :param chunk_size: Number of submissions enriched together.
+        :return: Number of quizzes updated.
+        """
+        return FeedbackPipeline(self, max_workers=max_workers, chunk_size=chunk_size).run(limit=limit)
+
+    def generate_course_feedback(self, limit: int = None, max_workers: int = 1) -> dict:
+        """
+        Generates feedback for every eligible submission of the course in one batch.
+        Requires a generator created without a user_id.
+
+        :param limit: Optional limit for the number of submissions to process.
+        :param max_workers: Maximum number of LLM requests in flight at once.
+        :return: Dictionary containing the number of quizzes updated.
+        """
+        if self.user_id is not None:
+            raise ValueError("Course batch mode requires a generator created without a user_id.")
+
+        self.get_quiz_to_update(limit=limit)
+        self.get_details_to_generate_feedback()
+        return self.generate_feedback(max_workers=max_workers)
+
+    def get_changed_quizzes(self, tracker: DeltaTracker, limit: int = None, regenerate: bool = False, now: datetime = None) -> dict:
+        """
+        Selects the submissions of the course that need feedback since its last delta run: eligible
+        submissions without feedback that no run has generated feedback for, submissions an earlier run
+        could not finish and, with regenerate, submissions whose answers or scores changed since their
+        feedback was generated.
+
+        :param tracker: Change tracking of the earlier runs.
+        :param limit: Optional limit for the number of submissions to select.
+        :param regenerate: Also select changed submissions that already have feedback. Changed submissions
+            whose regeneration failed in an earlier run are selected either way.
+        :param now: Due date cutoff of the run. Defaults to the current time.
+        :return: Dictionary with the selected 'quizzes', the IDs of the 'new' and 'changed' submissions,
+            the current 'fingerprints' of the eligible submissions and whether the selection was 'truncated'.
+        """
+        now = now if now is not None else datetime.now()
+        df = self.context.course_quiz_rows(self.course_id)
+        condition = (
+            df['submission_id'].notna()
+            & (df['attempt'] == 1)
+            & (df['submission_dropped'] == 0)
+            & (df['quiz_dropped'] == 0)
+            & (df['visible_to_everyone'] == 1)
+            & (df['due_date'] < now)
+        )
+        df = df[condition.fillna(False)]
+
+        # A submission without feedback is new unless a run already generated its feedback. The due date
+        # and ID of the last run are not enough: a submission can become eligible after the run, e.g.
+        # when it is made visible, with an older due date and a smaller ID than the high-water mark.
+        known = tracker.fingerprints(self.course_id)
+        missing = df['feedback'].isnull()
+        pending = df['submission_id'].isin(list(tracker.pending(self.course_id)))
+        new = missing & (~df['submission_id'].isin(list(known)) | pending)
+
+        # Fingerprints are only needed for submissions already processed, and for those about to be
+        tracked = df[df['submission_id'].isin(list(known)) | new | df['feedback'].notna()]
+        answers = self.df_user_answer
+        fingerprints = fingerprint_submissions(tracked, answers[answers['submission_id'].isin(tracked['submission_id'])])
+        changed = [submission_id for submission_id, fingerprint in known.items()
+                   if submission_id in fingerprints and fingerprints[submission_id] != fingerprint]
+
+        # A regeneration that failed is pending, and is retried even without regenerate
+        regenerated = df['submission_id'].isin(changed) & ~new & (regenerate | pending)
+        selected = pd.concat([df[new], df[regenerated]])
+        truncated = bool(limit) and len(selected) > limit
+        if truncated:
+            selected = selected[:limit]
+
+        return {
+            'quizzes': selected.to_dict(orient='records'),
+            'new': df.loc[new, 'submission_id'].tolist(),
+            'changed': changed,
+            'fingerprints': fingerprints,
+            'truncated': truncated,
+        }
+
+    def generate_feedback_delta(self, tracker: DeltaTracker = None, limit: int = None, regenerate: bool = False, max_workers: int = 1) -> dict:
+        """
+        Generates feedback only for the submissions that are new or changed since the last delta run
+        of the course, then records their fingerprints and moves the high-water mark forward.
+        Requires a generator created without a user_id.
+
+        :param tracker: Change tracking of the runs. Defaults to a tracker next to the columnar cache of the workbook.
+        :param limit: Optional limit for the number of submissions to process.
+        :param regenerate: Regenerate the feedback of submissions whose answers or scores were edited.
+        :param max_workers: Maximum number of LLM requests in flight at once.
+        :return: Counts of the new, changed, regenerated, updated and pending submissions.
+        """
+        if self.user_id is not None:
+            raise ValueError("Delta runs track whole courses and require a generator created without a user_id.")
+        if tracker is None:
+            name = os.path.splitext(os.path.basename(self.context.file_name))[0]
+            tracker = DeltaTracker(os.path.join(os.path.dirname(self.context.file_name) or '.', '.cache', f"{name}.delta.sqlite"))
+
+        now = datetime.now()
+        delta = self.get_changed_quizzes(tracker, limit=limit, regenerate=regenerate, now=now)
+        self.to_update_feedback_quizzes = delta['quizzes']
+        self.failed_submissions = []
+        if self.to_update_feedback_quizzes:
+            self.get_details_to_generate_feedback()
+            self.generate_feedback(max_workers=max_workers)
+
+        # A failed regeneration keeps the old feedback, so the feedback column alone does not tell it apart
+        selected = [quiz['submission_id'] for quiz in delta['quizzes']]
+        feedback = self.df_quiz['feedback']
+        failed_generation = set(self.failed_submissions)
+        completed = [
+            submission_id for submission_id in selected
+            if submission_id not in failed_generation and feedback.iloc[self.context.submission_index[submission_id]].notna().all()
+        ]
+        failed = set(selected) - set(completed)
+
+        # Submissions that already had feedback are fingerprinted too, as the baseline for later edits;
+        # changed submissions that were not regenerated keep their old fingerprint
+        known = tracker.fingerprints(self.course_id)
+        skipped = set(delta['changed']) - set(completed)
+        record = {
+            submission_id: fingerprint for submission_id, fingerprint in delta['fingerprints'].items()
+            if submission_id in completed or (submission_id not in known and submission_id not in failed and submission_id not in skipped
+                                              and feedback.iloc[self.context.submission_index[submission_id]].notna().all())
+        }
+        tracker.record_fingerprints(self.course_id, record)
+        tracker.set_pending(self.course_id, failed)
+        if not delta['truncated']:
+            tracker.set_watermark(self.course_id, now, self.context.course_quiz_rows(self.course_id)['submission_id'].max())
+
+        result = {
+            'new': len(delta['new']),
+            'changed': len(delta['changed']),
+            'regenerated': len(set(completed) & set(delta['changed'])),
+            'updated': len(completed),
+            'pending': len(failed),
+        }
+        METRICS.report(f"Delta run of course {self.course_id}: {result}", event='delta_run', course_id=self.course_id, **result)
+        return result
+
+
+def start_run(course_ids: list, user_id = None, limit: int = None, max_workers: int = 1, run_id: str = None,
+              context: FeedbackDataContext = None, openai: OpenAIChatResponse = None) -> str:
+    """
+    Generates feedback for every course in `course_ids` under a run checkpoint. Each feedback is
+    recorded in the checkpoint as soon as it arrives, so an interrupted run can be continued
+    with resume(run_id) without paying for the same submissions again.
+
+    :param course_ids: The IDs of the courses to generate feedback for.
+    :param user_id: Optional ID of a single user. If None, every user of each course is covered.
+    :param limit: Optional limit for the number of submissions per course.
+    :param max_workers: Maximum number of LLM requests in flight at once.
+    :param run_id: The ID of the run. Defaults to a new random ID.
+    :param context: Shared data context to read from.
+    :param openai: Chat client used to generate feedback.
+    :return: The ID of the run.
+    """
+    params = {'course_ids': list(course_ids), 'user_id': user_id, 'limit': limit, 'max_workers': max_workers}
+    checkpoint = RunCheckpoint.create(params, run_id=run_id)
+    METRICS.report(f"Started run {checkpoint.run_id}", event='run_started', run_id=checkpoint.run_id)
+    run_checkpoint(checkpoint, context=context, openai=openai)
+    return checkpoint.run_id
+
+def resume(run_id: str, context: FeedbackDataContext = None, openai: OpenAIChatResponse = None) -> int:
+    """
+    Continues an interrupted run with its original parameters. Feedback recorded in the checkpoint
+    is restored, and only the submissions that were not completed are sent to the LLM.
+
+    :param run_id: The ID of the run, as returned by start_run.
+    :param context: Shared data context to read from.
+    :param openai: Chat client used to generate feedback.
+    :return: Number of quizzes updated by the resumed run.
+    """
+    checkpoint = RunCheckpoint(run_id)
+    if not checkpoint.params:
+        raise ValueError(f"No checkpoint found for run {run_id}.")
+    METRICS.report(f"Resuming run {run_id} with {len(checkpoint.completed)} completed submissions", event='run_resumed',
+                   run_id=run_id, completed=len(checkpoint.completed))
+    return run_checkpoint(checkpoint, context=context, openai=openai)
+
+def run_checkpoint(checkpoint: RunCheckpoint, context: FeedbackDataContext = None, openai: OpenAIChatResponse = None) -> int:
+    """
+    Runs the courses of a checkpoint, skipping the submissions it has already completed.
+
+    :return: Number of quizzes updated.
+    """
+    params = checkpoint.params
+    updated = 0
+    restored = False
+    qfg = None
+
+    for course_id in params['course_ids']:
+        qfg = QuizFeedbackGenerator(course_id, user_id=params['user_id'], context=context, openai=openai)
+        qfg.checkpoint = checkpoint
+        if not restored:
+            restored_feedbacks = qfg.restore_checkpoint()
+            METRICS.report(f"Restored {restored_feedbacks} feedbacks from run {checkpoint.run_id}", event='run_restored',
+                           run_id=checkpoint.run_id, restored=restored_feedbacks)
+            restored = True
+        if course_id in checkpoint.completed_courses:
+            continue
+
+        limit = params['limit']
+        if limit:
+            limit -= checkpoint.course_counts[course_id]  # Submissions of the course completed before the interruption
+
+        failed = 0
+        if limit is None or limit > 0:
+            qfg.get_quiz_to_update(limit=limit)
+            if qfg.to_update_feedback_quizzes:
+                completed = len(checkpoint.completed)
+                qfg.get_details_to_generate_feedback()
+                qfg.generate_feedback(max_workers=params['max_workers'])
+                updated += len(checkpoint.completed) - completed
+                failed = len(qfg.to_update_feedback_quizzes) - (len(checkpoint.completed) - completed)
+
+        if not failed:  # Failed submissions are retried when the run is resumed
+            checkpoint.complete_course(course_id)
+
+    # Every update is already durable in the changelog and the checkpoint, so the workbook is written once
+    if qfg is not None:
+        qfg.save_data()
+
+    return updated
+
 
 # if __name__ == "__main__":
 #     course_id = 395298
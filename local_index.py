@@ -0,0 +1,176 @@
+from database import PineConeAPI
+import json
+import numpy as np
+import os
+import threading
+
+OPERATORS = {
+    '$eq': lambda value, operand: value == operand,
+    '$ne': lambda value, operand: value != operand,
+    '$in': lambda value, operand: value in operand,
+    '$nin': lambda value, operand: value not in operand,
+    '$gt': lambda value, operand: value is not None and value > operand,
+    '$gte': lambda value, operand: value is not None and value >= operand,
+    '$lt': lambda value, operand: value is not None and value < operand,
+    '$lte': lambda value, operand: value is not None and value <= operand,
+}
+
+def matches_filter(metadata: dict, filter: dict) -> bool:
+    """
+    Evaluates a Pinecone metadata filter ($eq, $ne, $in, $nin, $gt, $gte, $lt, $lte, $exists, $and, $or)
+    against the metadata of a vector.
+    """
+    for field, condition in filter.items():
+        if field == '$and':
+            if not all(matches_filter(metadata, part) for part in condition):
+                return False
+        elif field == '$or':
+            if not any(matches_filter(metadata, part) for part in condition):
+                return False
+        else:
+            value = metadata.get(field)
+            if not isinstance(condition, dict):
+                condition = {'$eq': condition}
+            for operator, operand in condition.items():
+                if operator == '$exists':
+                    if (field in metadata) != operand:
+                        return False
+                elif isinstance(value, list) and operator in ('$eq', '$in'):
+                    # List fields match when any of their elements does
+                    if not any(OPERATORS[operator](item, operand) for item in value):
+                        return False
+                elif not OPERATORS[operator](value, operand):
+                    return False
+    return True
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+class LocalIndex:
+
+    def __init__(self, directory: str = 'data/vector_index'):
+        """
+        In-process stand-in for a Pinecone index, read from a snapshot with one folder per namespace.
+        Each folder holds the unit-normalized vectors as a float32 .npy matrix, which is memory-mapped,
+        and the IDs and metadata of the rows in records.json. Scores are cosine similarities.
+
+        :param directory: Directory of the snapshot.
+        """
+        self.directory = directory
+        self.namespaces = {}
+        self.lock = threading.Lock()
+
+    def namespace_path(self, namespace: str) -> str:
+        return os.path.join(self.directory, str(namespace))
+
+    def load(self, namespace: str) -> tuple:
+        """
+        :return: The memory-mapped vectors, IDs and metadata of a namespace, or None if it is not in the snapshot.
+        """
+        namespace = str(namespace)
+        with self.lock:
+            if namespace not in self.namespaces:
+                path = self.namespace_path(namespace)
+                if not os.path.exists(os.path.join(path, 'vectors.npy')):
+                    return None
+                vectors = np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r')
+                with open(os.path.join(path, 'records.json'), encoding='utf-8') as f:
+                    records = json.load(f)
+                self.namespaces[namespace] = (vectors, [record['id'] for record in records], [record['metadata'] for record in records])
+            return self.namespaces[namespace]
+
+    def write(self, namespace: str, ids: list, vectors, metadata: list):
+        """
+        Writes the vectors of a namespace to the snapshot, replacing what was there.
+
+        :param namespace: The namespace, usually the course ID.
+        :param ids: The vector IDs.
+        :param vectors: The vectors, one row per ID.
+        :param metadata: The metadata of each vector.
+        """
+        path = self.namespace_path(namespace)
+        os.makedirs(path, exist_ok=True)
+        vectors = normalize_rows(np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1))
+        np.save(os.path.join(path, 'vectors.npy'), vectors)
+        with open(os.path.join(path, 'records.json'), 'w', encoding='utf-8') as f:
+            json.dump([{'id': str(vector_id), 'metadata': meta or {}} for vector_id, meta in zip(ids, metadata)], f)
+        with self.lock:
+            self.namespaces.pop(str(namespace), None)
+
+    def export_namespace(self, index, namespace: str, batch_size: int = 100) -> int:
+        """
+        Copies a namespace of a Pinecone index into the snapshot.
+
+        :param index: The Pinecone index.
+        :param namespace: The namespace, usually the course ID.
+        :param batch_size: Number of vectors fetched per request.
+        :return: Number of vectors exported.
+        """
+        ids, vectors, metadata = [], [], []
+        for page in index.list(namespace=str(namespace), limit=batch_size):
+            page_ids = [getattr(vector, 'id', vector) for vector in getattr(page, 'vectors', page)]
+            for vector_id, vector in index.fetch(ids=page_ids, namespace=str(namespace)).vectors.items():
+                ids.append(vector_id)
+                vectors.append(vector.values)
+                metadata.append(dict(vector.metadata or {}))
+        self.write(namespace, ids, vectors, metadata)
+        return len(ids)
+
+    def query(self, vector, namespace: str = '', filter: dict = None, top_k: int = 3, include_metadata: bool = True, **kwargs) -> dict:
+        """
+        Same arguments and result shape as the query of a Pinecone index.
+
+        :return: Dictionary with the best matches, each with id, score and metadata.
+        """
+        loaded = self.load(namespace)
+        if loaded is None:
+            return {'matches': [], 'namespace': str(namespace)}
+        vectors, ids, metadata = loaded
+
+        query = normalize_rows(np.asarray(vector, dtype=np.float32))
+        scores = vectors @ query
+
+        if filter:
+            # Rows are checked in score order until top_k of them pass the filter
+            order = np.argsort(-scores, kind='stable')
+            selected = []
+            for row in order:
+                if matches_filter(metadata[row], filter):
+                    selected.append(row)
+                    if len(selected) == top_k:
+                        break
+        else:
+            k = min(top_k, len(ids))
+            if k == 0:
+                selected = []
+            else:
+                selected = np.argpartition(-scores, k - 1)[:k]
+                selected = selected[np.argsort(-scores[selected], kind='stable')]
+
+        matches = []
+        for row in selected:
+            match = {'id': ids[row], 'score': float(scores[row])}
+            if include_metadata:
+                match['metadata'] = metadata[row]
+            matches.append(match)
+        return {'matches': matches, 'namespace': str(namespace)}
+
+class LocalVectorIndex(PineConeAPI):
+
+    def __init__(self, logger, directory: str = 'data/vector_index', embedder = None):
+        """
+        PineConeAPI backed by a LocalIndex snapshot instead of the Pinecone service, for offline and
+        test environments. fetch_relevant_results, fetch_relevant_results_bulk and fetch_response keep
+        their arguments: the course ID is the namespace, and filter, top_k and score_threshold apply as before.
+
+        :param logger: Logger for errors and progress.
+        :param directory: Directory of the snapshot, as written by LocalIndex.export_namespace.
+        :param embedder: Embedder of the queries, with embed_query and embed_documents. Defaults to
+            OpenAIEmbedder, which needs OPENAI_API_KEY; pass a local embedder to run fully offline.
+        """
+        self.logger = logger
+        self.index = LocalIndex(directory)
+        self.embedder = embedder
+        self.summary_store = None
@@ -0,0 +1,185 @@
+from contextlib import contextmanager
+from functools import wraps
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class Metrics:
+
+    def __init__(self, buckets: tuple = BUCKETS):
+        """
+        Thread-safe collector of run metrics: a latency histogram and row count per stage, and
+        counters for LLM requests, retries, errors and tokens.
+
+        :param buckets: Upper bounds in seconds of the latency histogram buckets.
+        """
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.logger = None  # Set by use_structured_logging
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+            self.counters = {}
+
+    def observe(self, stage: str, seconds: float, rows: int = None):
+        """
+        Records one run of a stage.
+
+        :param stage: Name of the stage, e.g. load_file or llm_call.
+        :param seconds: Wall time of the run.
+        :param rows: Number of rows or items the run produced, if known.
+        """
+        with self.lock:
+            entry = self.stages.get(stage)
+            if entry is None:
+                entry = self.stages[stage] = {
+                    'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'rows': 0,
+                    'buckets': [0] * (len(self.buckets) + 1),
+                }
+            entry['count'] += 1
+            entry['seconds'] += seconds
+            entry['max_seconds'] = max(entry['max_seconds'], seconds)
+            entry['buckets'][bisect.bisect_left(self.buckets, seconds)] += 1
+            if rows is not None:
+                entry['rows'] += rows
+
+    def increment(self, name: str, value: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def timer(self, stage: str):
+        """
+        Times the body of a with block as a run of the stage. The yielded dictionary takes an
+        optional 'rows' count.
+        """
+        info = {'rows': None}
+        start = time.perf_counter()
+        try:
+            yield info
+        finally:
+            self.observe(stage, time.perf_counter() - start, info['rows'])
+
+    def timed(self, stage: str, count_rows: bool = True):
+        """
+        Decorator that times every call of a function as a run of the stage.
+
+        :param stage: Name of the stage.
+        :param count_rows: Count the length of the result as rows.
+        """
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                result = None
+                try:
+                    result = function(*args, **kwargs)
+                    return result
+                finally:
+                    rows = len(result) if count_rows and hasattr(result, '__len__') else None
+                    self.observe(stage, time.perf_counter() - start, rows)
+            return wrapper
+        return decorator
+
+    def summary(self) -> dict:
+        """
+        :return: JSON-serializable summary with the count, total, mean and max wall time, rows and
+            approximate p50/p95 of every stage, and the counters.
+        """
+        with self.lock:
+            stages = {}
+            for stage, entry in self.stages.items():
+                stages[stage] = {
+                    'count': entry['count'],
+                    'seconds': round(entry['seconds'], 6),
+                    'mean_seconds': round(entry['seconds'] / entry['count'], 6),
+                    'max_seconds': round(entry['max_seconds'], 6),
+                    'p50_seconds': self.quantile(entry, 0.5),
+                    'p95_seconds': self.quantile(entry, 0.95),
+                    'rows': entry['rows'],
+                }
+            return {'stages': stages, 'counters': dict(self.counters)}
+
+    def quantile(self, entry: dict, q: float) -> float:
+        """
+        :return: Upper bound of the histogram bucket holding the quantile, capped at the max wall time.
+        """
+        target = q * entry['count']
+        seen = 0
+        for index, count in enumerate(entry['buckets']):
+            seen += count
+            if seen >= target and count and index < len(self.buckets):
+                return min(self.buckets[index], round(entry['max_seconds'], 6))
+        return round(entry['max_seconds'], 6)
+
+    def to_prometheus(self, prefix: str = 'feedback') -> str:
+        """
+        :return: The metrics in the Prometheus text exposition format.
+        """
+        lines = [
+            f"# HELP {prefix}_stage_seconds Wall time of each pipeline stage.",
+            f"# TYPE {prefix}_stage_seconds histogram",
+        ]
+        with self.lock:
+            for stage, entry in sorted(self.stages.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, entry['buckets']):
+                    cumulative += count
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {entry["count"]}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {entry["seconds"]}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {entry["count"]}')
+
+            lines.append(f"# HELP {prefix}_stage_rows_total Rows or items produced by each pipeline stage.")
+            lines.append(f"# TYPE {prefix}_stage_rows_total counter")
+            for stage, entry in sorted(self.stages.items()):
+                lines.append(f'{prefix}_stage_rows_total{{stage="{stage}"}} {entry["rows"]}')
+
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                lines.append(f"{prefix}_{name}_total {value}")
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str):
+        """
+        Writes the metrics to a file: Prometheus text for .prom files, the JSON summary otherwise.
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            if path.endswith('.prom'):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.summary(), f, indent=2)
+
+    def use_structured_logging(self, logger: logging.Logger = None, enabled: bool = True):
+        """
+        Sends the progress messages of report() to a logger as JSON lines instead of printing them.
+
+        :param logger: The logger. Defaults to the 'feedback' logger.
+        :param enabled: False restores printing.
+        """
+        self.logger = (logger if logger is not None else logging.getLogger('feedback')) if enabled else None
+
+    def report(self, message: str, event: str = None, **fields):
+        """
+        Prints a progress message, or logs it as a JSON line with its fields when structured logging is on.
+
+        :param message: The human readable message.
+        :param event: Name of the event in the structured log.
+        :param fields: Values logged with the event.
+        """
+        if self.logger is None:
+            print(message)
+        else:
+            self.logger.info(json.dumps({'event': event or 'message', 'message': message, **fields}, default=str))
+
+METRICS = Metrics()  # Shared by every generator, context and chat client of the process
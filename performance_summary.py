@@ -0,0 +1,135 @@
+from collections import Counter
+import pandas as pd
+
+def is_eligible(row: dict) -> bool:
+    """
+    Same eligibility as get_past_performance_query, for a single past performance record.
+    """
+    return (
+        is_equal(row['attempt'], 1)
+        and is_equal(row['published'], 1)
+        and is_equal(row['visible_to_everyone'], 1)
+        and is_equal(row['submission_dropped'], 0)
+        and is_equal(row['quiz_dropped'], 0)
+        and pd.notna(row['feedback'])
+    )
+
+def is_equal(value, expected) -> bool:
+    """
+    Compares a flag with a value; a missing flag (NaN or pd.NA of a nullable column) never matches.
+    """
+    return bool(pd.notna(value) and value == expected)
+
+def wrong_question_types(question_answers: pd.DataFrame, user_answers: pd.DataFrame) -> list:
+    """
+    :param question_answers: Question and answer rows of a quiz.
+    :param user_answers: User answer rows of a submission of the quiz.
+    :return: Question types of the questions answered with a choice worth less than full marks.
+    """
+    chosen = user_answers.merge(
+        question_answers[['question_id', 'answer_id', 'question_type', 'weight']],
+        left_on=['question_id', 'user_answer'], right_on=['question_id', 'answer_id'])
+    return chosen.loc[chosen['weight'] < 100, 'question_type'].tolist()
+
+class PerformanceSummary:
+
+    def __init__(self, recent: int = 3, digest_chars: int = 200):
+        """
+        Compact per-user history of past quizzes, used in prompts instead of the full text of past feedback.
+        Each entry keeps the score, the question types answered wrongly and a short digest of the feedback.
+
+        :param recent: Number of recent quizzes whose scores and feedback digests are shown.
+        :param digest_chars: Maximum length of a feedback digest.
+        """
+        self.recent = recent
+        self.digest_chars = digest_chars
+        self.entries = {}  # (course_id, user_id) -> {quiz_id: entry}
+
+    @classmethod
+    def from_tables(cls, df_quiz: pd.DataFrame, df_question_answer: pd.DataFrame, df_user_answer: pd.DataFrame,
+                    df_past_performance: pd.DataFrame, **kwargs) -> 'PerformanceSummary':
+        """
+        Builds the summaries of every user from the quiz tables in one pass.
+        """
+        summary = cls(**kwargs)
+
+        submissions = df_quiz.loc[df_quiz['submission_id'].notna(), ['submission_id', 'quiz_id', 'user_id', 'course_id']]
+        chosen = df_user_answer.merge(submissions, on='submission_id').merge(
+            df_question_answer[['course_id', 'quiz_id', 'question_id', 'answer_id', 'question_type', 'weight']],
+            left_on=['course_id', 'quiz_id', 'question_id', 'user_answer'],
+            right_on=['course_id', 'quiz_id', 'question_id', 'answer_id'])
+        chosen = chosen[chosen['weight'] < 100]
+        wrong = chosen.groupby(['course_id', 'user_id', 'quiz_id'])['question_type'].agg(list).to_dict()
+
+        for row in df_past_performance.to_dict(orient='records'):
+            if is_eligible(row):
+                key = (row['course_id'], row['user_id'], row['quiz_id'])
+                summary.add(*key, row['due_date'], row['final_score'], row['total_score'], row['feedback'], wrong.get(key, []))
+
+        return summary
+
+    def digest(self, feedback) -> str:
+        """
+        Shortens a feedback to its overall summary, which comes before the "Strengths" section.
+        """
+        text = ' '.join(str(feedback).split())
+        text = text.split('Strengths:')[0].strip()
+        if len(text) <= self.digest_chars:
+            return text
+        text = text[:self.digest_chars]
+        end = text.rfind('. ')
+        return text[:end + 1] if end > 0 else text + "..."
+
+    def add(self, course_id, user_id, quiz_id, due_date, final_score, total_score, feedback, wrong_types: list):
+        """
+        Adds or replaces the entry of a quiz in the user's history.
+        """
+        score = final_score / total_score * 100 if pd.notna(final_score) and total_score else None
+        self.entries.setdefault((course_id, user_id), {})[quiz_id] = {
+            'due_date': due_date,
+            'score': score,
+            'wrong_types': Counter(wrong_types),
+            'digest': self.digest(feedback),
+        }
+
+    def summarize(self, course_id, user_id, before) -> dict:
+        """
+        :param course_id: The ID of the course.
+        :param user_id: The ID of the user.
+        :param before: Only quizzes due before this date are summarized.
+        :return: The summary, or None if the user has no past quizzes with feedback.
+        """
+        entries = [
+            entry for entry in self.entries.get((course_id, user_id), {}).values()
+            if pd.notna(entry['due_date']) and entry['due_date'] < before
+        ]
+        if not entries:
+            return None
+        entries.sort(key=lambda entry: entry['due_date'])
+
+        scores = [entry['score'] for entry in entries if entry['score'] is not None]
+        wrong_types = Counter()
+        for entry in entries:
+            wrong_types.update(entry['wrong_types'])
+
+        return {
+            'quizzes': len(entries),
+            'average_score': sum(scores) / len(scores) if scores else None,
+            'recent_scores': scores[-self.recent:],
+            'trend': score_trend(scores),
+            'weak_question_types': wrong_types.most_common(3),
+            'recent_feedback': [(entry['due_date'], entry['digest']) for entry in entries[-self.recent:]],
+        }
+
+def score_trend(scores: list) -> str:
+    """
+    Compares the latest score with the average of the earlier ones.
+    """
+    if len(scores) < 2:
+        return "not enough data"
+    change = scores[-1] - sum(scores[:-1]) / len(scores[:-1])
+    if change > 5:
+        return "improving"
+    if change < -5:
+        return "declining"
+    return "steady"
@@ -0,0 +1,153 @@
+from queue import Empty, Full, Queue
+from typing import Iterator
+import threading
+from metrics import METRICS
+
+DONE = object()
+
+class FeedbackPipeline:
+
+    def __init__(self, generator, max_workers: int = 4, chunk_size: int = 50, queue_size: int = 32):
+        """
+        Streams submissions through select -> enrich -> render -> generate -> persist. Stages are
+        connected by bounded queues, so feedback is persisted as soon as it is generated. The selected
+        submissions and their past performance are read up front; the combined questions and the
+        prompts in flight depend on chunk_size and queue_size rather than on the size of the course.
+
+        :param generator: The QuizFeedbackGenerator whose data, prompts and LLM client are used.
+        :param max_workers: Number of LLM requests in flight at once.
+        :param chunk_size: Number of submissions enriched together.
+        :param queue_size: Capacity of the queues between the stages.
+        """
+        self.generator = generator
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.queue_size = queue_size
+
+    def select(self, limit: int = None) -> Iterator[tuple]:
+        """
+        Selects the submissions waiting for feedback and reads their past performance at once, before
+        any feedback of the run is persisted. Prompts then do not depend on how far the persist stage
+        got, and match the prompts of build_prompts.
+
+        :return: Chunks of submissions, each with the past performance of its submissions.
+        """
+        self.generator.performance_summaries = {}
+        quizzes = self.generator.get_quiz_to_update_query(limit=limit)
+        past_performance = self.generator.get_past_performance(quizzes)
+        for start in range(0, len(quizzes), self.chunk_size):
+            yield quizzes[start:start + self.chunk_size], past_performance
+
+    def enrich(self, chunks: Iterator[tuple]) -> Iterator[tuple]:
+        """
+        :return: (quiz, questions, past quizzes) of every submission.
+        """
+        for chunk, past_performance in chunks:
+            quiz_details = self.generator.get_quiz_details(chunk)
+            for quiz in chunk:
+                submission_id = quiz['submission_id']
+                yield quiz, quiz_details[submission_id], past_performance.get(submission_id)
+
+    def render(self, items: Iterator[tuple]) -> Iterator[tuple]:
+        """
+        :return: (submission ID, prompt) of every submission.
+        """
+        for quiz, questions, past_quizzes in items:
+            yield quiz['submission_id'], self.generator.build_prompt(quiz, questions, past_quizzes)
+
+    def put(self, queue: Queue, item, stop: threading.Event) -> bool:
+        """
+        Puts an item on a queue, giving up once the run is stopped.
+
+        :return: True if the item was put.
+        """
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def get(self, queue: Queue, stop: threading.Event):
+        """
+        Takes an item from a queue, or DONE once the run is stopped.
+        """
+        while not stop.is_set():
+            try:
+                return queue.get(timeout=0.1)
+            except Empty:
+                continue
+        return DONE
+
+    def produce(self, prompts: Queue, errors: list, limit: int, stop: threading.Event):
+        try:
+            for item in self.render(self.enrich(self.select(limit))):
+                if not self.put(prompts, item, stop):
+                    break
+        except Exception as e:
+            errors.append(e)
+        finally:
+            for _ in range(self.max_workers):
+                self.put(prompts, DONE, stop)
+
+    def generate(self, prompts: Queue, results: Queue, stop: threading.Event):
+        try:
+            while True:
+                item = self.get(prompts, stop)
+                if item is DONE:
+                    break
+                submission_id, prompt = item
+                try:
+                    feedback = self.generator.openai.generate_response(query=prompt, max_token=self.generator.max_token)
+                except Exception as e:
+                    # The submission counts as a failed generation, and the worker moves on to the next one
+                    METRICS.increment('llm_errors')
+                    METRICS.report(f'Error generating response: {e}', event='llm_error', submission_id=submission_id, error=str(e))
+                    feedback = None
+                if not self.put(results, (submission_id, feedback), stop):
+                    break
+        finally:
+            self.put(results, DONE, stop)
+
+    def run(self, limit: int = None) -> int:
+        """
+        Runs the pipeline until every selected submission has been persisted.
+
+        :param limit: Optional limit for the number of submissions to process.
+        :return: Number of quizzes updated.
+        """
+        self.generator.prompt_tokens = {}
+        self.generator.trimmed_prompts = []
+        self.generator.failed_submissions = []
+
+        prompts = Queue(maxsize=self.queue_size)
+        results = Queue(maxsize=self.queue_size)
+        errors = []
+        stop = threading.Event()
+
+        threads = [threading.Thread(target=self.produce, args=(prompts, errors, limit, stop), daemon=True)]
+        threads += [threading.Thread(target=self.generate, args=(prompts, results, stop), daemon=True) for _ in range(self.max_workers)]
+        for thread in threads:
+            thread.start()
+
+        updated = 0
+        running = self.max_workers
+        try:
+            while running:
+                item = results.get()
+                if item is DONE:
+                    running -= 1
+                    continue
+                submission_id, feedback = item
+                METRICS.report(f"**************** - updated_submission_id {submission_id} - *****************",
+                               event='feedback_generated', submission_id=submission_id, generated=feedback is not None)
+                updated += self.generator.apply_generated_feedback(submission_id, feedback)
+        finally:
+            stop.set()  # Releases the producer and the workers if persisting failed
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
+
+        return updated
@@ -0,0 +1,98 @@
+def compact(value) -> str:
+    """
+    Collapses runs of whitespace in a value to single spaces.
+    """
+    return ' '.join(str(value).split())
+
+class QuizPromptRenderer:
+
+    def __init__(self):
+        """
+        Renders the current quiz and past performance sections of the feedback prompt.
+
+        The question and answer choice lines of a question are the same for every student who took
+        the quiz, so they are rendered once per (quiz_id, question_id) and only the student's choice
+        is added per submission. Parts are collected in lists and joined once, with compact whitespace.
+        """
+        self.question_blocks = {}
+
+    def question_block(self, quiz_id, question: dict) -> str:
+        key = (quiz_id, question['question_id'])
+        block = self.question_blocks.get(key)
+        if block is None:
+            lines = [f"{question['question_id']} | {compact(question['question_name'])} : {compact(question['question_text'])}"]
+            for index, answer in enumerate(question['answer_choices']):
+                lines.append(f"{index + 1} | Id: {answer['answer_id']} | Text: {compact(answer['answer_text'])} | Weight: {answer['weight']}")
+            block = '\n'.join(lines)
+            self.question_blocks[key] = block
+        return block
+
+    def render_current_quiz(self, quiz: dict, questions: list) -> str:
+        """
+        :param quiz: Dictionary containing current quiz data.
+        :param questions: Combined list of questions with user answers of the submission.
+        :return: Formatted current quiz string.
+        """
+        quiz_date = str(quiz['due_date']) if quiz['due_date'] else "N/A"
+        quiz_id = quiz['quiz_id']
+
+        parts = [
+            "Current Quiz Details:",
+            f"Quiz Date: {quiz_date}",
+            f"Quiz Id: {quiz_id}",
+            f"Score: {quiz['final_score']} / {quiz['total_score']}",
+        ]
+        for question in questions:
+            parts.append(self.question_block(quiz_id, question))
+            parts.append(f"Student's Choice Id : {question.get('user_answer', 'Not Attempted')}")
+
+        return '\n'.join(parts)
+
+    def render_past_performance(self, past_quizzes: list) -> str:
+        """
+        :param past_quizzes: Past quiz records of the user, latest first.
+        :return: Formatted past performance string.
+        """
+        if not past_quizzes:
+            return "Past Performance: Not Available."
+
+        parts = ["Past Performance:"]
+        for index, quiz in enumerate(past_quizzes):
+            quiz_date = str(quiz['due_date']) if quiz['due_date'] else "N/A"
+            score = quiz['final_score'] if quiz['final_score'] else "N/A"
+            total_score = quiz['total_score'] if quiz['total_score'] else "N/A"
+
+            parts.append(f"Quiz {index + 1}")
+            parts.append(f"Past Quiz Date: {quiz_date}")
+            parts.append(f"Past Score: {score} / {total_score}")
+            parts.append(f"Past Feedback: {quiz['feedback']}")
+
+        return '\n'.join(parts)
+
+    def render_performance_summary(self, summary: dict) -> str:
+        """
+        :param summary: Summary of the user's past quizzes, from PerformanceSummary.summarize.
+        :return: Formatted past performance string of roughly constant size.
+        """
+        if not summary:
+            return "Past Performance: Not Available."
+
+        average = f"{summary['average_score']:.0f}%" if summary['average_score'] is not None else "N/A"
+        parts = [
+            "Past Performance Summary:",
+            f"Past Quizzes: {summary['quizzes']} (average score {average})",
+            f"Recent Scores (oldest to latest): {', '.join(f'{score:.0f}%' for score in summary['recent_scores']) or 'N/A'}",
+            f"Trend: {summary['trend']}",
+        ]
+        if summary['weak_question_types']:
+            weak = ', '.join(f"{question_type} ({count})" for question_type, count in summary['weak_question_types'])
+            parts.append(f"Most Missed Question Types: {weak}")
+        if summary['recent_feedback']:
+            parts.append("Recent Feedback Digest:")
+            for due_date, digest in summary['recent_feedback']:
+                parts.append(f"- {due_date}: {digest}")
+
+        return '\n'.join(parts)
+
+    def clear(self):
+        self.question_blocks = {}
@@ -0,0 +1,99 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+class ResponseCache:
+
+    def __init__(self, path: str = 'data/.cache/responses.sqlite', max_entries: int = None, ttl: float = None):
+        """
+        Persistent, content-addressed cache of LLM responses stored in a SQLite file.
+
+        :param path: Path of the SQLite file.
+        :param max_entries: Maximum number of cached responses. The least recently used are evicted first.
+        :param ttl: Time to live of a cached response in seconds. None keeps responses forever.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self.connection.commit()
+
+    @staticmethod
+    def key(model: str, max_token: int, query: str) -> str:
+        """
+        :return: SHA-256 of the model, token limit and rendered prompt.
+        """
+        return hashlib.sha256(f"{model}\0{max_token}\0{query}".encode('utf-8')).hexdigest()
+
+    def get(self, model: str, max_token: int, query: str) -> Optional[str]:
+        """
+        :return: The cached response, or None on a miss or an expired entry.
+        """
+        key = self.key(model, max_token, query)
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.connection.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.connection.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, model: str, max_token: int, query: str, response: str):
+        key = self.key(model, max_token, query)
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, response, now, now))
+            self.connection.commit()
+        self.evict(now)
+
+    def evict(self, now: float = None):
+        """
+        Removes expired entries and, if the cache is over max_entries, the least recently used ones.
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            if self.ttl is not None:
+                self.connection.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+            if self.max_entries is not None:
+                self.connection.execute("""
+                    DELETE FROM responses WHERE key IN (
+                        SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                    )
+                """, (self.max_entries,))
+            self.connection.commit()
+
+    def stats(self) -> dict:
+        with self.lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
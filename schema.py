@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+
+# Column kinds of the four sheets. 'int' columns become the smallest integer type that holds their
+# values (float64 when values are missing, as read_excel gives them), 'category' columns repeated strings, 'datetime' columns datetime64 and 'float' columns
+# float64. Other columns (free text such as feedback) are left as they are.
+SCHEMA = {
+    'quiz_to_update': {
+        'quiz_id': 'int', 'user_id': 'int', 'submission_id': 'int', 'course_id': 'int',
+        'final_score': 'float', 'total_score': 'float', 'due_at': 'datetime', 'attempt': 'int',
+        'submission_dropped': 'int', 'published': 'int', 'visible_to_everyone': 'int', 'quiz_dropped': 'int',
+        'due_date': 'datetime',
+    },
+    'quiz_question_answers': {
+        'quiz_id': 'int', 'course_id': 'int', 'question_id': 'int', 'question_name': 'category',
+        'question_type': 'category', 'question_text': 'category', 'answer_id': 'int', 'weight': 'int',
+    },
+    'quiz_user_answer': {
+        'submission_id': 'int', 'question_id': 'int', 'user_answer': 'int',
+    },
+    'quiz_user_past_performance': {
+        'user_id': 'int', 'quiz_id': 'int', 'course_id': 'int', 'attempt': 'int', 'published': 'int',
+        'visible_to_everyone': 'int', 'submission_dropped': 'int', 'quiz_dropped': 'int',
+        'total_score': 'float', 'final_score': 'float', 'due_date': 'datetime',
+    },
+}
+
+INT_TYPES = ['Int8', 'Int16', 'Int32', 'Int64']
+
+def smallest_int_type(values: pd.Series) -> str:
+    """
+    :param values: Non-null integral values.
+    :return: The smallest nullable integer type holding the values.
+    """
+    if values.empty:
+        return 'Int8'
+    low, high = values.min(), values.max()
+    for name in INT_TYPES:
+        info = np.iinfo(name.lower())
+        if info.min <= low and high <= info.max:
+            return name
+    return 'Int64'
+
+def coerce_column(series: pd.Series, kind: str) -> pd.Series:
+    """
+    Converts a column to the compact type of its kind. The column is returned unchanged when the
+    conversion would lose values, e.g. text in an id column or fractions in an int column. Missing
+    values stay NaN, so values render the same as without the conversion: an int column with
+    missing values is kept as float64 rather than a nullable integer type, whose pd.NA renders as
+    <NA> and whose values lose their ".0".
+
+    :param series: The column.
+    :param kind: 'int', 'float', 'category' or 'datetime'.
+    :return: The converted column.
+    """
+    missing = series.isna().sum()
+    if kind in ('int', 'float'):
+        numeric = pd.to_numeric(series, errors='coerce')
+        if numeric.isna().sum() != missing:
+            return series
+        if kind == 'float' and pd.api.types.is_integer_dtype(series):
+            return series  # Whole scores render without ".0", so they are not widened
+        if kind == 'float' or missing:
+            return numeric.astype('float64')
+        present = numeric.dropna()
+        if (present % 1 != 0).any():
+            return series
+        return numeric.astype(smallest_int_type(present))
+    if kind == 'datetime':
+        if pd.api.types.is_datetime64_any_dtype(series):
+            return series
+        dates = pd.to_datetime(series, errors='coerce')
+        return dates if dates.isna().sum() == missing else series
+    if kind == 'category':
+        # Only worth it when values repeat
+        if series.nunique(dropna=True) <= len(series) / 2:
+            return series.astype('category')
+        return series
+    return series
+
+def apply_schema(tables: dict, schema: dict = None) -> tuple:
+    """
+    Coerces the quiz tables to compact types.
+
+    :param tables: Dictionary of sheet name to DataFrame.
+    :param schema: Column kinds per sheet. Defaults to SCHEMA.
+    :return: The converted tables and a report of the memory of each sheet before and after, in bytes.
+    """
+    schema = schema if schema is not None else SCHEMA
+    converted = {}
+    report = {}
+    for sheet, df in tables.items():
+        before = int(df.memory_usage(deep=True).sum())
+        columns = {
+            column: coerce_column(df[column], kind)
+            for column, kind in schema.get(sheet, {}).items() if column in df.columns
+        }
+        df = df.assign(**columns) if columns else df
+        converted[sheet] = df
+        report[sheet] = {'before': before, 'after': int(df.memory_usage(deep=True).sum())}
+    return converted, report
+
+def summarize_memory(report: dict) -> dict:
+    """
+    :return: Total memory before and after the conversion in MB, and the share saved.
+    """
+    before = sum(sheet['before'] for sheet in report.values())
+    after = sum(sheet['after'] for sheet in report.values())
+    return {
+        'before_mb': round(before / 2 ** 20, 2),
+        'after_mb': round(after / 2 ** 20, 2),
+        'saved_percent': round(100 * (1 - after / before), 1) if before else 0.0,
+    }
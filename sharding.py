@@ -0,0 +1,98 @@
+from feedback_generator_testing import QuizFeedbackGenerator
+from data_context import FeedbackDataContext
+from storage import ExcelStorage, ReadOnlyColumnarStorage
+from metrics import METRICS
+from utils import OpenAIChatResponse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable
+import multiprocessing
+import os
+
+def shard_courses(course_ids: list, pending: dict, shards: int) -> list:
+    """
+    Splits courses into shards of about the same amount of work: courses are taken from the
+    largest to the smallest number of pending submissions and given to the least loaded shard.
+
+    :param course_ids: The IDs of the courses.
+    :param pending: Dictionary of course ID to number of submissions waiting for feedback.
+    :param shards: Number of shards.
+    :return: List of non-empty lists of course IDs.
+    """
+    loads = [[0, []] for _ in range(max(1, shards))]
+    for course_id in sorted(course_ids, key=lambda course_id: pending.get(course_id, 0), reverse=True):
+        load = min(loads, key=lambda load: load[0])
+        load[0] += pending.get(course_id, 0)
+        load[1].append(course_id)
+    return [courses for _, courses in loads if courses]
+
+def generate_shard(file_name: str, cache_dir: str, course_ids: list, limit: int, max_workers: int, openai_factory: Callable) -> dict:
+    """
+    Worker of generate_feedback_sharded. Reads the columnar cache read-only and generates the
+    feedback of its courses without writing anything. The tables are used with the dtypes they were
+    cached with, so they are not coerced, and copied, a second time.
+
+    :return: The change set (submission ID to feedback) and the metrics of the shard.
+    """
+    METRICS.reset()
+    context = FeedbackDataContext(file_name, storage=ReadOnlyColumnarStorage(file_name, cache_dir), compact_dtypes=False)
+    openai = openai_factory()
+    for course_id in course_ids:
+        qfg = QuizFeedbackGenerator(course_id, context=context, openai=openai)
+        qfg.get_quiz_to_update(limit=limit)
+        if qfg.to_update_feedback_quizzes:
+            qfg.get_details_to_generate_feedback()
+            qfg.generate_feedback(max_workers=max_workers)
+
+    changes = {submission_id: feedback for submission_id, feedback in context.changes.items() if feedback is not None}
+    return {'course_ids': course_ids, 'pid': os.getpid(), 'changes': changes, 'metrics': METRICS.summary()}
+
+def generate_feedback_sharded(course_ids: list, file_name: str = 'data/feedback_generator.xlsx', processes: int = None,
+                              limit: int = None, max_workers: int = 1, openai_factory: Callable = OpenAIChatResponse,
+                              context: FeedbackDataContext = None) -> list:
+    """
+    Generates the feedback of many courses on all cores. Courses are sharded across a process pool;
+    each worker loads its own copy of the tables from the columnar cache of the workbook instead of
+    receiving pickled DataFrames, and returns its change set. The parent merges every change set into the shared
+    context, and saves once at the end.
+
+    :param course_ids: The IDs of the courses.
+    :param file_name: Path to the Excel workbook.
+    :param processes: Number of worker processes. Defaults to the number of cores.
+    :param limit: Optional limit for the number of submissions per course.
+    :param max_workers: Maximum number of LLM requests in flight at once in each worker.
+    :param openai_factory: Picklable callable returning the chat client of a worker.
+    :param context: Data context of the parent. Defaults to the process-wide context of the workbook.
+    :return: One report per shard with its courses, number of merged submissions and metrics.
+    """
+    context = context if context is not None else FeedbackDataContext.shared(file_name)
+    if not isinstance(context.storage, ExcelStorage):
+        raise ValueError("Sharded generation reads the columnar cache of the workbook and requires ExcelStorage.")
+
+    # Workers read the cache, so pending updates are compacted into it first
+    if context.changes or context.storage.pending_updates():
+        context.compact(force=True)
+
+    df = context.df_quiz
+    pending = df.loc[df['course_id'].isin(course_ids) & df['submission_id'].notna() & df['feedback'].isnull()]
+    pending = pending.groupby('course_id').size().to_dict()
+    processes = processes if processes else os.cpu_count() or 1
+    shards = shard_courses(list(course_ids), pending, min(processes, len(course_ids)))
+    if not shards:
+        return []
+
+    reports = []
+    # Workers are spawned rather than forked, so they do not inherit the parent's locks and threads
+    with ProcessPoolExecutor(max_workers=len(shards), mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [
+            executor.submit(generate_shard, context.file_name, context.storage.cache.cache_dir, shard, limit, max_workers, openai_factory)
+            for shard in shards
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            merged = context.merge_changes(result['changes'])
+            METRICS.report(f"Merged {merged} feedbacks of courses {result['course_ids']} from worker {result['pid']}",
+                           event='shard_merged', course_ids=result['course_ids'], merged=merged)
+            reports.append({'course_ids': result['course_ids'], 'merged': merged, 'metrics': result['metrics']})
+
+    context.compact()
+    return reports
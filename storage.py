@@ -0,0 +1,493 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+from typing import Dict, Optional
+
+SHEET_NAMES = [
+    'quiz_to_update',
+    'quiz_question_answers',
+    'quiz_user_answer',
+    'quiz_user_past_performance',
+]
+
+class ColumnarCache:
+
+    def __init__(self, file_name: str, cache_dir: Optional[str] = None):
+        """
+        Initializes a Parquet cache of the sheets of an Excel workbook.
+
+        :param file_name: Path to the source Excel workbook.
+        :param cache_dir: Directory holding the cached sheets. Defaults to a `.cache` folder next to the workbook.
+        """
+        self.file_name = file_name
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(file_name) or '.', '.cache')
+        self.cache_dir = cache_dir
+        self.name = os.path.splitext(os.path.basename(file_name))[0]
+        self.manifest_path = os.path.join(self.cache_dir, f"{self.name}.manifest.json")
+
+    def sheet_path(self, sheet_name: str) -> str:
+        return os.path.join(self.cache_dir, f"{self.name}.{sheet_name}.parquet")
+
+    def source_stat(self) -> dict:
+        stat = os.stat(self.file_name)
+        return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+    def source_hash(self) -> str:
+        digest = hashlib.sha256()
+        with open(self.file_name, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def read_manifest(self) -> Optional[dict]:
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write_manifest(self, sha256: Optional[str] = None):
+        manifest = self.source_stat()
+        manifest['sha256'] = sha256 if sha256 else self.source_hash()
+        manifest['sheets'] = SHEET_NAMES
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def is_stale(self) -> bool:
+        """
+        Checks whether the cache needs to be rebuilt from the workbook.
+
+        The cheap mtime/size check is tried first; the content hash is only computed
+        when it fails, so touching the workbook without changing it does not force a rebuild.
+
+        :return: True if the cache is missing or out of date.
+        """
+        manifest = self.read_manifest()
+        if not manifest or any(not os.path.exists(self.sheet_path(sheet)) for sheet in SHEET_NAMES):
+            return True
+
+        stat = self.source_stat()
+        if stat['mtime_ns'] == manifest.get('mtime_ns') and stat['size'] == manifest.get('size'):
+            return False
+
+        sha256 = self.source_hash()
+        if sha256 != manifest.get('sha256'):
+            return True
+
+        self.write_manifest(sha256)
+        return False
+
+    def read_excel(self) -> Dict[str, pd.DataFrame]:
+        return {
+            sheet: pd.read_excel(self.file_name, sheet_name=sheet, engine='openpyxl')
+            for sheet in SHEET_NAMES
+        }
+
+    def write_tables(self, tables: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+        """
+        Writes the given tables to the cache and records the current state of the workbook.
+        Call this right after the workbook itself was written so the two stay in sync.
+
+        :param tables: Dictionary of sheet name to DataFrame.
+        :return: The tables as they were stored in the cache.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        stored = {}
+        for sheet in SHEET_NAMES:
+            stored[sheet] = normalize_object_columns(tables[sheet])
+            stored[sheet].to_parquet(self.sheet_path(sheet), index=False)
+        self.write_manifest()
+        return stored
+
+    def rebuild(self) -> Dict[str, pd.DataFrame]:
+        return self.write_tables(self.read_excel())
+
+    def load(self, memory_map: bool = False) -> Dict[str, pd.DataFrame]:
+        """
+        Loads the four sheets, converting the workbook only when it changed since the last load.
+
+        :param memory_map: Read the Parquet files through memory maps instead of buffered reads. The
+            decoded tables are still private to the process.
+        :return: Dictionary of sheet name to DataFrame.
+        """
+        if self.is_stale():
+            return self.rebuild()
+
+        return {sheet: restore_missing(pd.read_parquet(self.sheet_path(sheet), memory_map=memory_map)) for sheet in SHEET_NAMES}
+
+def normalize_object_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converts mixed-type object columns (e.g. numeric answer texts) to strings so they can be stored in Parquet.
+
+    :param df: DataFrame to normalize.
+    :return: DataFrame with homogeneous object columns.
+    """
+    df = df.copy()
+    for column in df.columns[df.dtypes == object]:
+        values = df[column]
+        df[column] = values.where(values.isna(), values.astype(str))
+    return df
+
+def restore_missing(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Parquet gives back the missing values of object columns as None, where read_excel gives NaN.
+    Converts them to NaN, so the tables, and the prompts rendered from them, are the same whether
+    they were read from the workbook or from the cache.
+
+    :param df: DataFrame read from the cache.
+    :return: DataFrame with NaN for the missing values of its object columns.
+    """
+    for column in df.columns[df.dtypes == object]:
+        values = df[column]
+        if values.isna().any():
+            df[column] = values.where(values.notna(), np.nan)
+    return df
+
+def open_jsonl(path: str):
+    """
+    Opens a JSON lines file for appending. A partially written last line, left by a crash, is cut
+    off first, so the next record starts on a line of its own instead of being glued onto it.
+
+    :param path: Path of the JSON lines file.
+    :return: The file, opened in append mode.
+    """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        with open(path, 'r+b') as f:
+            size = f.seek(0, os.SEEK_END)
+            end = size
+            while end > 0:
+                start = max(0, end - 4096)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b'\n')
+                if newline != -1:
+                    end = start + newline + 1
+                    break
+                end = start
+            if end != size:
+                f.truncate(end)
+                f.flush()
+                os.fsync(f.fileno())
+    return open(path, 'a', encoding='utf-8')
+
+def append_jsonl(file, entries: list):
+    """
+    Writes entries to a JSON lines file, one per line, with a single fsync.
+
+    :param file: File opened with open_jsonl.
+    :param entries: JSON serializable entries.
+    """
+    for entry in entries:
+        file.write(json.dumps(entry) + '\n')
+    file.flush()
+    os.fsync(file.fileno())
+
+def read_jsonl(path: str) -> list:
+    """
+    :param path: Path of the JSON lines file.
+    :return: The entries of the file in the order they were written. Lines that can not be parsed,
+        e.g. a partially written line left by a crash, are skipped.
+    """
+    if not os.path.exists(path):
+        return []
+    entries = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+    return entries
+
+class FeedbackChangeLog:
+
+    def __init__(self, path: str):
+        """
+        Append-only log of feedback updates. Each update is flushed and fsynced as it is written,
+        so it survives a crash until the next compaction merges it into the workbook.
+
+        :param path: Path of the JSON lines file.
+        """
+        self.path = path
+        self.file = None
+
+    def append(self, submission_id, quiz_id, user_id, feedback):
+        self.extend([(submission_id, quiz_id, user_id, feedback)])
+
+    def extend(self, updates: list):
+        """
+        Appends many updates with a single fsync.
+
+        :param updates: List of (submission_id, quiz_id, user_id, feedback) tuples.
+        """
+        if self.file is None:
+            self.file = open_jsonl(self.path)
+        append_jsonl(self.file, [
+            {
+                'submission_id': to_json_value(submission_id),
+                'quiz_id': to_json_value(quiz_id),
+                'user_id': to_json_value(user_id),
+                'feedback': to_json_value(feedback),
+            }
+            for submission_id, quiz_id, user_id, feedback in updates
+        ])
+
+    def read(self) -> list:
+        """
+        :return: The logged updates in the order they were written. Partially written lines are skipped.
+        """
+        return read_jsonl(self.path)
+
+    def clear(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def to_json_value(value):
+    if value is pd.NA or value is pd.NaT:
+        return None
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+class ExcelStorage:
+
+    pushdown = False
+
+    def __init__(self, file_name: str, cache_dir: Optional[str] = None):
+        """
+        Storage backend keeping the quiz tables in the Excel workbook, read through the columnar
+        cache, with feedback updates appended to a changelog until the next compaction.
+
+        :param file_name: Path to the Excel workbook.
+        :param cache_dir: Directory of the columnar cache.
+        """
+        self.file_name = file_name
+        self.cache = ColumnarCache(file_name, cache_dir)
+        self.changelog = FeedbackChangeLog(os.path.splitext(file_name)[0] + '.changelog.jsonl')
+
+    def load(self) -> Dict[str, pd.DataFrame]:
+        return self.cache.load()
+
+    def pending_updates(self) -> list:
+        return self.changelog.read()
+
+    def record_update(self, submission_id, quiz_id, user_id, feedback):
+        self.changelog.append(submission_id, quiz_id, user_id, feedback)
+
+    def record_updates(self, updates: list):
+        self.changelog.extend(updates)
+
+    def compact(self, tables: Dict[str, pd.DataFrame]):
+        """
+        Rewrites the workbook and the columnar cache from the given tables and empties the changelog.
+
+        :param tables: Dictionary of sheet name to DataFrame.
+        """
+        with pd.ExcelWriter(path=self.file_name, engine='openpyxl') as writer:
+            for sheet in SHEET_NAMES:
+                tables[sheet].to_excel(writer, sheet_name=sheet, index=False)
+        self.cache.write_tables(tables)
+        self.changelog.clear()
+
+class ReadOnlyColumnarStorage:
+
+    pushdown = False
+
+    def __init__(self, file_name: str, cache_dir: Optional[str] = None):
+        """
+        Read-only view of the columnar cache of a workbook, for worker processes. Each worker decodes
+        its own copy of the tables from the Parquet files, which is much cheaper than parsing the
+        workbook. Updates are only kept in the change set of the data context, for the parent
+        process to merge.
+
+        :param file_name: Path to the Excel workbook.
+        :param cache_dir: Directory of the columnar cache.
+        """
+        self.file_name = file_name
+        self.cache = ColumnarCache(file_name, cache_dir)
+
+    def load(self) -> Dict[str, pd.DataFrame]:
+        if self.cache.is_stale():
+            raise ValueError(f"The columnar cache of {self.file_name} is out of date. Load the workbook in the parent process first.")
+        return self.cache.load(memory_map=True)
+
+    def pending_updates(self) -> list:
+        return []
+
+    def record_update(self, submission_id, quiz_id, user_id, feedback):
+        pass
+
+    def record_updates(self, updates: list):
+        pass
+
+    def compact(self, tables: Dict[str, pd.DataFrame]):
+        raise ValueError("ReadOnlyColumnarStorage can not be written to.")
+
+class SQLiteStorage:
+
+    pushdown = True
+
+    DATE_COLUMNS = ['due_at', 'due_date']
+
+    INDEXES = {
+        'quiz_to_update_submission': ('quiz_to_update', ['submission_id']),
+        'quiz_to_update_course_user': ('quiz_to_update', ['course_id', 'user_id']),
+        'quiz_question_answers_course_quiz': ('quiz_question_answers', ['course_id', 'quiz_id']),
+        'quiz_user_answer_submission': ('quiz_user_answer', ['submission_id']),
+        'quiz_user_past_performance_course_user_due': ('quiz_user_past_performance', ['course_id', 'user_id', 'due_date']),
+        'quiz_user_past_performance_quiz_user': ('quiz_user_past_performance', ['quiz_id', 'user_id']),
+    }
+
+    def __init__(self, path: str, source_file: Optional[str] = None):
+        """
+        Storage backend keeping the quiz tables in an embedded SQLite database. The eligibility
+        filters run as indexed queries and feedback updates are written in a transaction.
+
+        :param path: Path of the SQLite database.
+        :param source_file: Excel workbook to import the tables from when the database is empty.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+
+        if source_file and not self.has_tables():
+            self.import_tables(ExcelStorage(source_file).load())
+
+    def has_tables(self) -> bool:
+        rows = self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+        return set(SHEET_NAMES) <= {row[0] for row in rows}
+
+    def import_tables(self, tables: Dict[str, pd.DataFrame]):
+        """
+        Replaces the tables of the database with the given ones and creates the indexes.
+
+        :param tables: Dictionary of sheet name to DataFrame.
+        """
+        with self.lock:
+            for sheet in SHEET_NAMES:
+                tables[sheet].to_sql(sheet, self.connection, if_exists='replace', index=False)
+            for name, (table, columns) in self.INDEXES.items():
+                self.connection.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+            self.connection.commit()
+
+    def read_query(self, query: str, params: tuple = ()) -> pd.DataFrame:
+        with self.lock:
+            df = restore_missing(pd.read_sql_query(query, self.connection, params=params))
+        for column in self.DATE_COLUMNS:
+            if column in df.columns:
+                df[column] = pd.to_datetime(df[column])
+        return df
+
+    def load(self) -> Dict[str, pd.DataFrame]:
+        return {sheet: self.read_query(f"SELECT * FROM {sheet} ORDER BY rowid") for sheet in SHEET_NAMES}
+
+    def pending_updates(self) -> list:
+        return []
+
+    def record_update(self, submission_id, quiz_id, user_id, feedback):
+        """
+        Writes the feedback of a submission to both tables in a single transaction.
+        """
+        feedback = to_json_value(feedback)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE quiz_to_update SET feedback = ? WHERE submission_id = ?",
+                (feedback, to_json_value(submission_id)))
+            self.connection.execute(
+                "UPDATE quiz_user_past_performance SET feedback = ? WHERE quiz_id = ? AND user_id = ?",
+                (feedback, to_json_value(quiz_id), to_json_value(user_id)))
+
+    def record_updates(self, updates: list):
+        """
+        Writes the feedback of many submissions in a single transaction.
+
+        :param updates: List of (submission_id, quiz_id, user_id, feedback) tuples.
+        """
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "UPDATE quiz_to_update SET feedback = ? WHERE submission_id = ?",
+                [(to_json_value(feedback), to_json_value(submission_id)) for submission_id, _, _, feedback in updates])
+            self.connection.executemany(
+                "UPDATE quiz_user_past_performance SET feedback = ? WHERE quiz_id = ? AND user_id = ?",
+                [(to_json_value(feedback), to_json_value(quiz_id), to_json_value(user_id)) for _, quiz_id, user_id, feedback in updates])
+
+    def compact(self, tables: Dict[str, pd.DataFrame]):
+        # Updates are written to the database as they happen
+        pass
+
+    def quiz_to_update_query(self, course_id, user_id, now, limit: int = None) -> pd.DataFrame:
+        """
+        :param course_id: The ID of the course.
+        :param user_id: The ID of the user, or None for every user of the course.
+        :param now: Only quizzes due before this date are returned.
+        :param limit: Optional limit for the number of quizzes to fetch.
+        :return: Submissions waiting for feedback, in table order.
+        """
+        query = """
+            SELECT * FROM quiz_to_update
+            WHERE submission_id IS NOT NULL
+              AND attempt = 1
+              AND submission_dropped = 0
+              AND quiz_dropped = 0
+              AND visible_to_everyone = 1
+              AND feedback IS NULL
+              AND course_id = ?
+              AND due_date < ?
+        """
+        params = [to_json_value(course_id), sql_datetime(now)]
+        if user_id is not None:
+            query += " AND user_id = ?"
+            params.append(to_json_value(user_id))
+        query += " ORDER BY rowid"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        return self.read_query(query, tuple(params))
+
+    def past_performance_query(self, course_id, user_id, due_before, limit: int = 3) -> pd.DataFrame:
+        """
+        :param course_id: The ID of the course.
+        :param user_id: The ID of the user.
+        :param due_before: Only quizzes due before this date are returned.
+        :param limit: Optional limit for the number of past quizzes.
+        :return: Past quizzes with feedback, latest first.
+        """
+        query = """
+            SELECT * FROM quiz_user_past_performance
+            WHERE course_id = ?
+              AND user_id = ?
+              AND due_date < ?
+              AND attempt = 1
+              AND published = 1
+              AND visible_to_everyone = 1
+              AND submission_dropped = 0
+              AND quiz_dropped = 0
+              AND feedback IS NOT NULL
+            ORDER BY due_date DESC
+        """
+        params = [to_json_value(course_id), to_json_value(user_id), sql_datetime(due_before)]
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        return self.read_query(query, tuple(params))
+
+def sql_datetime(value) -> str:
+    """
+    Formats a date the way pandas stores datetimes in SQLite, so the two compare as text.
+    """
+    return pd.Timestamp(value).isoformat(sep=' ')
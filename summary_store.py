@@ -0,0 +1,111 @@
+from embedding_cache import normalize_text
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+class SummaryStore:
+
+    def __init__(self, path: str = 'data/.cache/summaries.sqlite'):
+        """
+        Persistent store of chunk summaries, keyed by the hash of the chunk text. A chunk is summarized
+        once, however many queries retrieve it, and a changed chunk gets a new key. The Pinecone vector
+        IDs of a chunk are kept in a table of their own, as several vectors can hold the same text.
+
+        :param path: Path of the SQLite file.
+        """
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS summaries (
+                key TEXT PRIMARY KEY,
+                summary TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS summary_vectors (
+                vector_id TEXT PRIMARY KEY,
+                key TEXT NOT NULL
+            )
+        """)
+        self.connection.commit()
+
+    @staticmethod
+    def key(text: str) -> str:
+        """
+        :return: SHA-256 of the normalized chunk text.
+        """
+        return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+    def get_many(self, texts: list) -> dict:
+        """
+        :return: Dictionary of text to summary, for the texts that have one.
+        """
+        keys = {self.key(text): text for text in texts}
+        found = {}
+        with self.lock:
+            items = list(keys.items())
+            for start in range(0, len(items), 500):
+                chunk = items[start:start + 500]
+                rows = self.connection.execute(
+                    f"SELECT key, summary FROM summaries WHERE key IN ({','.join('?' * len(chunk))})",
+                    [key for key, _ in chunk]).fetchall()
+                for key, summary in rows:
+                    found[keys[key]] = summary
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def get(self, text: str):
+        return self.get_many([text]).get(text)
+
+    def has_vector(self, vector_id: str) -> bool:
+        with self.lock:
+            return self.connection.execute(
+                "SELECT 1 FROM summary_vectors WHERE vector_id = ?", (str(vector_id),)).fetchone() is not None
+
+    def set(self, text: str, summary: str, vector_ids: list = None):
+        """
+        Stores the summary of a chunk.
+
+        :param text: The chunk text.
+        :param summary: Its summary.
+        :param vector_ids: Optional Pinecone vector IDs holding the chunk.
+        """
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO summaries (key, summary, created_at) VALUES (?, ?, ?)",
+                (self.key(text), summary, time.time()))
+            self.link_vectors(text, vector_ids or [])
+            self.connection.commit()
+
+    def add_vectors(self, text: str, vector_ids: list):
+        """
+        Records more vector IDs holding a chunk that already has a summary.
+        """
+        with self.lock:
+            self.link_vectors(text, vector_ids)
+            self.connection.commit()
+
+    def link_vectors(self, text: str, vector_ids: list):
+        key = self.key(text)
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO summary_vectors (vector_id, key) VALUES (?, ?)",
+            [(str(vector_id), key) for vector_id in vector_ids])
+
+    def stats(self) -> dict:
+        with self.lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
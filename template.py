@@ -1,8 +1,10 @@
 from langchain.output_parsers import ResponseSchema, StructuredOutputParser
 from langchain.prompts import ChatPromptTemplate
+from langchain.prompts import HumanMessagePromptTemplate
 from langchain.schema.output_parser import StrOutputParser
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Dict, List, Optional, Tuple, Type, Union
 from pprint import pprint
+import threading
 
 class BaseTemplate:
     
@@ -24,6 +26,7 @@ class BaseTemplate:
         self.prompt = None
         self.output_parser = None
         self.format_instructions = None
+        self.render_text = None
 
     def build(self) -> Tuple[ChatPromptTemplate, Optional[str], Union[StructuredOutputParser, StrOutputParser]]:
         """
@@ -47,9 +50,30 @@ class BaseTemplate:
         else:
             self.output_parser = StrOutputParser()
             self.format_instructions = None
+
+        # A single human message with an f-string template renders to "Human: " + str.format of its text
+        self.render_text = None
+        if len(self.prompt.messages) == 1 and isinstance(self.prompt.messages[0], HumanMessagePromptTemplate):
+            message_prompt = self.prompt.messages[0].prompt
+            if getattr(message_prompt, 'template_format', None) == 'f-string':
+                self.render_text = "Human: " + message_prompt.template
             
         return self.prompt, self.format_instructions, self.output_parser
 
+    def render(self, **inputs) -> str:
+        """
+        Render the prompt with the given inputs. Gives the same string as `prompt.format(**inputs)`
+        but skips the langchain message machinery when the template is a single f-string message.
+
+        :param inputs: Values of the input variables of the template.
+        :return: The rendered prompt.
+        """
+        if self.prompt is None:
+            self.build()
+        if self.render_text is not None:
+            return self.render_text.format(**inputs)
+        return self.prompt.format(**inputs)
+
     def set_template_text(self, template_text: str) -> None:
         """
         Set the template text for the prompt.
@@ -149,6 +173,23 @@ class AutomatedFeedbackTemplate(BaseTemplate):
         """
         return super().build()
     
+COMPILED_TEMPLATES = {}
+COMPILED_TEMPLATES_LOCK = threading.Lock()
+
+def get_compiled_template(template_class: Type[BaseTemplate]) -> BaseTemplate:
+    """
+    Return the built instance of a template class, building it only on first use in this process.
+
+    :param template_class: A BaseTemplate subclass that can be created with its default arguments.
+    :return: The built template, ready for `render`.
+    """
+    with COMPILED_TEMPLATES_LOCK:
+        if template_class not in COMPILED_TEMPLATES:
+            template = template_class()
+            template.build()
+            COMPILED_TEMPLATES[template_class] = template
+        return COMPILED_TEMPLATES[template_class]
+
 if __name__ == "__main__":
     feedback_template = AutomatedFeedbackTemplate()
     prompt, format_instructions, output_parser = feedback_template.build()
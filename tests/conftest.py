@@ -0,0 +1,69 @@
+import hashlib
+import logging
+import os
+import shutil
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import generate_workbook  # noqa: E402
+from data_context import FeedbackDataContext  # noqa: E402
+from metrics import METRICS  # noqa: E402
+
+COURSE_ID = 100_000
+
+def respond(prompt: str) -> str:
+    """
+    Feedback that differs whenever the prompt does.
+    """
+    return f"Feedback {hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]}."
+
+class FlakyChat:
+
+    def __init__(self, fail=(), respond=None):
+        """
+        Chat client for the generators that fails, like generate_response after its retries, by
+        returning None for the calls whose 1-based number is in `fail`.
+
+        :param fail: Numbers of the calls that fail.
+        :param respond: Returns the feedback of a prompt. Defaults to a text derived from the prompt.
+        """
+        self.fail = set(fail)
+        self.respond = respond if respond is not None else (lambda query: f"Feedback of a prompt of {len(query)} characters.")
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def generate_response(self, query: str, model: str = "gpt-3.5-turbo", max_token: int = 4000):
+        with self.lock:
+            self.calls += 1
+            call = self.calls
+        return None if call in self.fail else self.respond(query)
+
+@pytest.fixture(autouse=True)
+def quiet_metrics():
+    METRICS.reset()
+    METRICS.use_structured_logging(logging.getLogger('feedback.tests'))
+    yield
+    METRICS.use_structured_logging(enabled=False)
+    METRICS.reset()
+
+@pytest.fixture(scope='session')
+def template_workbook(tmp_path_factory) -> str:
+    """
+    Synthetic workbook of one course: 8 users, 4 quizzes of 3 questions, the first 2 quizzes with feedback.
+    """
+    path = tmp_path_factory.mktemp('template') / 'feedback_generator.xlsx'
+    return generate_workbook(str(path), courses=1, users=8, quizzes=4, questions=3, choices=3, seed=7)
+
+@pytest.fixture
+def workbook(template_workbook, tmp_path) -> str:
+    path = tmp_path / 'feedback_generator.xlsx'
+    shutil.copyfile(template_workbook, path)
+    return str(path)
+
+@pytest.fixture
+def context(workbook) -> FeedbackDataContext:
+    return FeedbackDataContext(workbook)
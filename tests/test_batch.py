@@ -0,0 +1,82 @@
+import json
+import os
+
+from batch import LocalBatchProvider, parse_result_line, write_batch_file
+from conftest import COURSE_ID, FlakyChat, respond
+from feedback_generator_testing import QuizFeedbackGenerator
+
+def batch_generator(context) -> QuizFeedbackGenerator:
+    qfg = QuizFeedbackGenerator(COURSE_ID, context=context, openai=FlakyChat())
+    qfg.get_quiz_to_update(limit=None)
+    qfg.get_details_to_generate_feedback()
+    return qfg
+
+def test_batch_file_is_keyed_by_submission(tmp_path):
+    path = tmp_path / 'requests.jsonl'
+    write_batch_file(str(path), {11: 'first prompt', 12: 'second prompt'}, 'gpt-3.5-turbo', 100)
+
+    requests = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [request['custom_id'] for request in requests] == ['11', '12']
+    assert requests[1]['body']['messages'] == [{'role': 'user', 'content': 'second prompt'}]
+    assert requests[1]['body']['max_tokens'] == 100
+
+def test_batch_results_are_applied_by_submission(context, tmp_path):
+    qfg = batch_generator(context)
+    prompts = qfg.build_prompts()
+
+    provider = LocalBatchProvider(respond, directory=str(tmp_path / 'batches'))
+    updated = qfg.generate_feedback_batch(provider=provider, batch_file=str(tmp_path / 'requests.jsonl'), poll_interval=0)
+
+    assert updated == len(prompts) == 16
+    feedback = dict(zip(context.df_quiz['submission_id'], context.df_quiz['feedback']))
+    for submission_id, prompt in prompts.items():
+        assert feedback[submission_id] == respond(prompt)
+
+def test_failed_and_missing_results_stay_pending(context, tmp_path):
+    class PartialProvider(LocalBatchProvider):
+        def results(self, batch_id):
+            results = list(super().results(batch_id))
+            custom_id, _ = results[0]
+            return [(custom_id, None)] + results[2:]  # The first request failed, the second has no result
+
+    qfg = batch_generator(context)
+    provider = PartialProvider(respond, directory=str(tmp_path / 'batches'))
+    updated = qfg.generate_feedback_batch(provider=provider, batch_file=str(tmp_path / 'requests.jsonl'), poll_interval=0)
+
+    assert updated == 14
+    assert len(qfg.failed_submissions) == 2
+    pending = context.df_quiz.loc[context.df_quiz['submission_id'].isin(qfg.failed_submissions), 'feedback']
+    assert pending.isnull().all()
+
+def test_unfinished_batch_times_out(context, tmp_path):
+    class StuckProvider(LocalBatchProvider):
+        def status(self, batch_id):
+            return 'in_progress'
+
+    qfg = batch_generator(context)
+    provider = StuckProvider(respond, directory=str(tmp_path / 'batches'))
+    updated = qfg.generate_feedback_batch(provider=provider, batch_file=str(tmp_path / 'requests.jsonl'),
+                                          poll_interval=0.01, max_wait=0.05)
+
+    assert updated == 0
+    assert len(qfg.failed_submissions) == 16
+    assert context.df_quiz['feedback'].isnull().sum() == 16
+
+def test_failed_batch_without_output_leaves_everything_pending(context, tmp_path):
+    class FailedProvider(LocalBatchProvider):
+        def submit(self, path):
+            batch_id = super().submit(path)
+            os.remove(self.output_path(batch_id))
+            return batch_id
+
+    qfg = batch_generator(context)
+    provider = FailedProvider(respond, directory=str(tmp_path / 'batches'))
+    updated = qfg.generate_feedback_batch(provider=provider, batch_file=str(tmp_path / 'requests.jsonl'), poll_interval=0)
+
+    assert updated == 0
+    assert len(qfg.failed_submissions) == 16
+    assert context.df_quiz['feedback'].isnull().sum() == 16
+
+def test_error_lines_parse_as_failures():
+    line = json.dumps({'custom_id': '7', 'response': {'status_code': 500, 'body': {}}, 'error': None})
+    assert parse_result_line(line) == ('7', None)
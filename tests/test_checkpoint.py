@@ -0,0 +1,94 @@
+import shutil
+
+import pytest
+
+from benchmark import generate_workbook
+from checkpoint import RunCheckpoint
+from conftest import COURSE_ID, FlakyChat
+from data_context import FeedbackDataContext
+from feedback_generator_testing import resume, start_run
+
+class Interrupted(Exception):
+    pass
+
+def interrupt_after(calls: int):
+    """
+    :return: Responder that stops the run, like a killed process, once `calls` prompts were answered.
+    """
+    answered = []
+
+    def respond(query):
+        if len(answered) == calls:
+            raise Interrupted()
+        answered.append(query)
+        return f"Feedback {len(answered)}."
+    return respond
+
+def test_torn_line_is_ignored_and_truncated(tmp_path):
+    checkpoint = RunCheckpoint.create({'course_ids': [1]}, run_id='run', directory=str(tmp_path))
+    checkpoint.record(1, "first", 1)
+    with open(checkpoint.path, 'a', encoding='utf-8') as f:
+        f.write('{"submission_id": 2, "course_id": 1, "feedb')
+
+    checkpoint = RunCheckpoint('run', directory=str(tmp_path))
+    assert checkpoint.completed == {1: "first"}
+    checkpoint.record(3, "third", 1)
+
+    checkpoint = RunCheckpoint('run', directory=str(tmp_path))
+    assert checkpoint.params == {'course_ids': [1]}
+    assert checkpoint.completed == {1: "first", 3: "third"}
+    assert checkpoint.course_counts[1] == 2
+
+def test_resume_only_generates_the_rest(workbook, template_workbook, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # Checkpoints are written under data/.checkpoints
+    with pytest.raises(Interrupted):
+        start_run([COURSE_ID], run_id='run', context=FeedbackDataContext(workbook),
+                  openai=FlakyChat(respond=interrupt_after(5)))
+
+    checkpoint = RunCheckpoint('run')
+    assert len(checkpoint.completed) == 5
+    assert COURSE_ID not in checkpoint.completed_courses
+
+    # The process died before anything was saved: start again from the original workbook
+    shutil.copyfile(template_workbook, workbook)
+    (tmp_path / 'feedback_generator.changelog.jsonl').unlink(missing_ok=True)
+    context = FeedbackDataContext(workbook)
+    openai = FlakyChat()
+    assert resume('run', context=context, openai=openai) == 11
+    assert openai.calls == 11
+
+    feedback = dict(zip(context.df_quiz['submission_id'], context.df_quiz['feedback']))
+    for submission_id, text in checkpoint.completed.items():
+        assert feedback[submission_id] == text
+    assert COURSE_ID in RunCheckpoint('run').completed_courses
+
+    openai = FlakyChat()
+    assert resume('run', context=context, openai=openai) == 0
+    assert openai.calls == 0
+
+def test_failed_submissions_keep_the_course_open(context, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    start_run([COURSE_ID], run_id='run', context=context, openai=FlakyChat(fail={3, 4}))
+
+    checkpoint = RunCheckpoint('run')
+    assert len(checkpoint.completed) == 14
+    assert COURSE_ID not in checkpoint.completed_courses
+
+    openai = FlakyChat()
+    assert resume('run', context=context, openai=openai) == 2
+    assert openai.calls == 2
+    assert COURSE_ID in RunCheckpoint('run').completed_courses
+
+def test_many_courses_are_saved_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    context = FeedbackDataContext(generate_workbook(str(tmp_path / 'feedback_generator.xlsx'), courses=2, users=4,
+                                                    quizzes=3, questions=2, choices=2, seed=1))
+    compactions = []
+    compact = context.storage.compact
+    monkeypatch.setattr(context.storage, 'compact', lambda tables: compactions.append(1) or compact(tables))
+
+    start_run([COURSE_ID, COURSE_ID + 1], run_id='run', context=context, openai=FlakyChat())
+
+    assert len(compactions) == 1
+    assert context.df_quiz['feedback'].notna().all()
+    assert not context.storage.pending_updates()
@@ -0,0 +1,95 @@
+import pytest
+
+from conftest import COURSE_ID, FlakyChat, respond
+from delta import DeltaTracker
+from feedback_generator_testing import QuizFeedbackGenerator
+
+@pytest.fixture
+def tracker(tmp_path):
+    tracker = DeltaTracker(str(tmp_path / 'delta.sqlite'))
+    yield tracker
+    tracker.close()
+
+def delta_run(context, tracker, openai=None, **kwargs) -> dict:
+    qfg = QuizFeedbackGenerator(COURSE_ID, context=context, openai=openai if openai is not None else FlakyChat(respond=respond))
+    return qfg.generate_feedback_delta(tracker=tracker, **kwargs)
+
+def feedback_of(context, submission_id):
+    return context.df_quiz.loc[context.df_quiz['submission_id'] == submission_id, 'feedback'].iloc[0]
+
+def edit_score(context, submission_id):
+    rows = context.df_quiz['submission_id'] == submission_id
+    context.df_quiz.loc[rows, 'final_score'] = context.df_quiz.loc[rows, 'total_score'] - context.df_quiz.loc[rows, 'final_score']
+
+def test_second_run_only_processes_what_changed(context, tracker):
+    assert delta_run(context, tracker) == {'new': 16, 'changed': 0, 'regenerated': 0, 'updated': 16, 'pending': 0}
+
+    openai = FlakyChat(respond=respond)
+    assert delta_run(context, tracker, openai) == {'new': 0, 'changed': 0, 'regenerated': 0, 'updated': 0, 'pending': 0}
+    assert openai.calls == 0
+
+def test_truncated_run_leaves_the_rest_for_the_next_run(context, tracker):
+    assert delta_run(context, tracker, limit=5)['updated'] == 5
+    assert tracker.watermark(COURSE_ID) == (None, None)
+
+    result = delta_run(context, tracker)
+    assert (result['new'], result['updated']) == (11, 11)
+    assert context.df_quiz['feedback'].notna().all()
+
+def test_failed_submissions_stay_pending(context, tracker):
+    result = delta_run(context, tracker, FlakyChat(fail={3, 7}, respond=respond))
+    assert (result['updated'], result['pending']) == (14, 2)
+    assert len(tracker.pending(COURSE_ID)) == 2
+
+    openai = FlakyChat(respond=respond)
+    result = delta_run(context, tracker, openai)
+    assert (result['updated'], result['pending']) == (2, 0)
+    assert openai.calls == 2
+    assert not tracker.pending(COURSE_ID)
+
+def test_changed_submissions_are_reported_and_regenerated(context, tracker):
+    delta_run(context, tracker)
+    submission_id = context.df_quiz['submission_id'].iloc[-1]
+    before = feedback_of(context, submission_id)
+    edit_score(context, submission_id)
+
+    openai = FlakyChat(respond=respond)
+    assert delta_run(context, tracker, openai) == {'new': 0, 'changed': 1, 'regenerated': 0, 'updated': 0, 'pending': 0}
+    assert openai.calls == 0
+    assert feedback_of(context, submission_id) == before
+
+    result = delta_run(context, tracker, regenerate=True)
+    assert (result['changed'], result['regenerated']) == (1, 1)
+    assert feedback_of(context, submission_id) != before
+
+    # The new fingerprint is the baseline of the next run
+    assert delta_run(context, tracker, regenerate=True)['changed'] == 0
+
+def test_failed_regeneration_keeps_feedback_and_is_retried(context, tracker):
+    delta_run(context, tracker)
+    submission_id = context.df_quiz['submission_id'].iloc[-1]
+    before = feedback_of(context, submission_id)
+    edit_score(context, submission_id)
+
+    result = delta_run(context, tracker, FlakyChat(fail={1}, respond=respond), regenerate=True)
+    assert (result['regenerated'], result['pending']) == (0, 1)
+    assert feedback_of(context, submission_id) == before
+    assert tracker.pending(COURSE_ID) == {submission_id}
+
+    # Retried without regenerate, as the failure left it pending
+    result = delta_run(context, tracker)
+    assert (result['regenerated'], result['pending']) == (1, 0)
+    assert feedback_of(context, submission_id) != before
+
+def test_submission_released_after_a_run_is_new(context, tracker):
+    pending = context.df_quiz.loc[context.df_quiz['feedback'].isnull(), 'submission_id']
+    hidden = context.df_quiz['submission_id'] == pending.iloc[0]
+    context.df_quiz.loc[hidden, 'visible_to_everyone'] = 0
+    assert delta_run(context, tracker)['updated'] == 15
+
+    # Its due date and ID are below the high-water mark of the run
+    context.df_quiz.loc[hidden, 'visible_to_everyone'] = 1
+    openai = FlakyChat(respond=respond)
+    assert delta_run(context, tracker, openai) == {'new': 1, 'changed': 0, 'regenerated': 0, 'updated': 1, 'pending': 0}
+    assert openai.calls == 1
+    assert context.df_quiz['feedback'].notna().all()
@@ -0,0 +1,82 @@
+import shutil
+import time
+
+from benchmark import fake_chat_response
+from conftest import COURSE_ID, FlakyChat
+from data_context import FeedbackDataContext
+from feedback_generator_testing import QuizFeedbackGenerator
+from metrics import METRICS
+
+def generate(context, openai, max_workers):
+    qfg = QuizFeedbackGenerator(COURSE_ID, context=context, openai=openai)
+    qfg.get_quiz_to_update(limit=None)
+    qfg.get_details_to_generate_feedback()
+    qfg.generate_feedback(max_workers=max_workers)
+    return qfg
+
+def feedback_by_submission(context) -> dict:
+    df = context.df_quiz
+    return dict(zip(df['submission_id'], df['feedback']))
+
+def test_concurrent_feedback_maps_to_its_submission(workbook, template_workbook, tmp_path):
+    (tmp_path / 'sequential').mkdir()
+    sequential_workbook = tmp_path / 'sequential' / 'feedback_generator.xlsx'
+    shutil.copyfile(template_workbook, sequential_workbook)
+    sequential = FeedbackDataContext(str(sequential_workbook))
+    generate(sequential, fake_chat_response(latency=0), max_workers=1)
+
+    # Jitter makes the requests finish out of order
+    concurrent = FeedbackDataContext(workbook)
+    qfg = generate(concurrent, fake_chat_response(latency=0.001, jitter=0.01, seed=3), max_workers=4)
+
+    assert len(qfg.to_update_feedback_quizzes) == 16
+    assert feedback_by_submission(concurrent) == feedback_by_submission(sequential)
+
+def test_requests_in_flight_are_bounded(context):
+    class SlowChat(FlakyChat):
+        def __init__(self):
+            super().__init__()
+            self.in_flight = 0
+            self.peak = 0
+
+        def generate_response(self, query, model="gpt-3.5-turbo", max_token=4000):
+            with self.lock:
+                self.in_flight += 1
+                self.peak = max(self.peak, self.in_flight)
+            time.sleep(0.01)
+            with self.lock:
+                self.in_flight -= 1
+            return super().generate_response(query, model, max_token)
+
+    openai = SlowChat()
+    generate(context, openai, max_workers=3)
+
+    assert openai.calls == 16
+    assert 1 <= openai.peak <= 3
+
+def test_failed_generation_is_not_stored(context):
+    qfg = generate(context, FlakyChat(fail={2, 5}), max_workers=1)
+
+    failed = qfg.failed_submissions
+    assert len(failed) == 2
+    for submission_id in failed:
+        assert context.df_quiz.loc[context.df_quiz['submission_id'] == submission_id, 'feedback'].isnull().all()
+    assert all(entry['feedback'] is not None for entry in context.storage.pending_updates())
+    assert METRICS.summary()['counters']['feedback_failures'] == 2
+
+    # The failed submissions are selected again by the next run
+    retry = QuizFeedbackGenerator(COURSE_ID, context=context, openai=FlakyChat())
+    retry.get_quiz_to_update(limit=None)
+    assert sorted(quiz['submission_id'] for quiz in retry.to_update_feedback_quizzes) == sorted(failed)
+
+def test_failed_regeneration_keeps_existing_feedback(context):
+    generate(context, FlakyChat(), max_workers=1)
+    before = feedback_by_submission(context)
+
+    qfg = QuizFeedbackGenerator(COURSE_ID, context=context, openai=FlakyChat(fail=range(1, 100)))
+    qfg.to_update_feedback_quizzes = qfg.context.course_quiz_rows(COURSE_ID).to_dict(orient='records')[-4:]
+    qfg.get_details_to_generate_feedback()
+    qfg.generate_feedback(max_workers=2)
+
+    assert len(qfg.failed_submissions) == 4
+    assert feedback_by_submission(context) == before
@@ -0,0 +1,74 @@
+import shutil
+import threading
+
+import pytest
+
+from conftest import COURSE_ID, FlakyChat
+from data_context import FeedbackDataContext
+from feedback_generator_testing import QuizFeedbackGenerator
+from metrics import METRICS
+from pipeline import FeedbackPipeline
+
+def run_in_thread(pipeline: FeedbackPipeline, timeout: float = 10) -> dict:
+    """
+    Runs a pipeline with a deadline, so a hang fails the test instead of the suite.
+    """
+    outcome = {}
+
+    def target():
+        try:
+            outcome['updated'] = pipeline.run()
+        except Exception as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "the pipeline did not finish"
+    return outcome
+
+def test_raising_client_counts_every_submission_as_failed(context):
+    class RaisingChat(FlakyChat):
+        def generate_response(self, query, model="gpt-3.5-turbo", max_token=4000):
+            super().generate_response(query, model, max_token)
+            raise RuntimeError("connection reset")
+
+    openai = RaisingChat()
+    qfg = QuizFeedbackGenerator(COURSE_ID, context=context, openai=openai)
+    outcome = run_in_thread(FeedbackPipeline(qfg, max_workers=2, chunk_size=2, queue_size=1))
+
+    assert outcome == {'updated': 0}
+    assert openai.calls == 16
+    assert len(qfg.failed_submissions) == 16
+    assert METRICS.summary()['counters']['llm_errors'] == 16
+    assert context.df_quiz['feedback'].isnull().sum() == 16
+
+def test_failed_persist_stops_the_stages(context, monkeypatch):
+    qfg = QuizFeedbackGenerator(COURSE_ID, context=context, openai=FlakyChat())
+
+    def apply_generated_feedback(submission_id, feedback):
+        raise OSError("disk full")
+    monkeypatch.setattr(qfg, 'apply_generated_feedback', apply_generated_feedback)
+
+    outcome = run_in_thread(FeedbackPipeline(qfg, max_workers=2, chunk_size=2, queue_size=1))
+    assert isinstance(outcome['error'], OSError)
+
+@pytest.mark.parametrize('compact', [True, False])
+def test_prompts_do_not_depend_on_persisted_feedback(workbook, template_workbook, tmp_path, compact):
+    expected = QuizFeedbackGenerator(COURSE_ID, context=FeedbackDataContext(workbook), openai=FlakyChat())
+    expected.compact_past_performance = compact
+    expected.get_quiz_to_update(limit=None)
+    expected.get_details_to_generate_feedback()
+    expected = expected.build_prompts()
+
+    # One submission per chunk, so later users' earlier quizzes are persisted before they are rendered
+    (tmp_path / 'streaming').mkdir()
+    streaming_workbook = tmp_path / 'streaming' / 'feedback_generator.xlsx'
+    shutil.copyfile(template_workbook, streaming_workbook)
+    prompts = []
+    openai = FlakyChat(respond=lambda query: prompts.append(query) or "Feedback.")
+    qfg = QuizFeedbackGenerator(COURSE_ID, context=FeedbackDataContext(str(streaming_workbook)), openai=openai)
+    qfg.compact_past_performance = compact
+
+    assert FeedbackPipeline(qfg, max_workers=1, chunk_size=1, queue_size=1).run() == 16
+    assert sorted(prompts) == sorted(expected.values())
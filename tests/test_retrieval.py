@@ -0,0 +1,146 @@
+import logging
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from local_index import LocalVectorIndex
+from summary_store import SummaryStore
+
+COURSE = '100000'
+CHUNKS = ["Recursion calls a function from itself.", "A list keeps its items in order.", "A dict maps keys to values."]
+TOPICS = ['recursion', 'list', 'dict', 'unrelated']
+
+class KeywordEmbedder:
+
+    def __init__(self):
+        """
+        Embeds a text as the one-hot vector of the first topic word it contains, so a query only
+        matches the chunks of its topic. Texts without a topic word get a vector no chunk matches.
+        """
+        self.calls = 0
+
+    def embed_query(self, text: str) -> list:
+        self.calls += 1
+        text = text.lower()
+        topic = next((index for index, topic in enumerate(TOPICS) if topic in text), len(TOPICS) - 1)
+        return [1.0 if index == topic else 0.0 for index in range(len(TOPICS))]
+
+    def embed_documents(self, texts: list) -> list:
+        return [self.embed_query(text) for text in texts]
+
+class SummaryChat:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.summarized = []
+
+    def generate_summary(self, text: str) -> str:
+        with self.lock:
+            self.summarized.append(text)
+        return f"Summary: {text}"
+
+@pytest.fixture
+def api(tmp_path):
+    embedder = KeywordEmbedder()
+    api = LocalVectorIndex(logging.getLogger('feedback.tests'), directory=str(tmp_path / 'vector_index'), embedder=embedder)
+    api.index.write(COURSE, ['v1', 'v2', 'v3'], embedder.embed_documents(CHUNKS),
+                    [{'text': text, 'quiz_id': quiz_id} for text, quiz_id in zip(CHUNKS, [1, 2, 2])])
+    api.summary_store = SummaryStore(str(tmp_path / 'summaries.sqlite'))
+    yield api
+    api.summary_store.close()
+
+def test_bulk_matches_single_queries(api):
+    queries = ["What is recursion?", "How do I sort a list?"]
+    bulk = api.fetch_relevant_results_bulk(COURSE, queries, openai=SummaryChat(), top_k=1)
+
+    for query, df in zip(queries, bulk):
+        pd.testing.assert_frame_equal(df, api.fetch_relevant_results(COURSE, query, openai=SummaryChat(), top_k=1))
+    assert bulk[0]['text'].tolist() == [CHUNKS[0]]
+
+def test_bulk_skips_queries_without_matches(api):
+    openai = SummaryChat()
+    queries = ["What is recursion?", "Something unrelated", "What is a dict?"]
+    bulk = api.fetch_relevant_results_bulk(COURSE, queries, openai=openai, top_k=1, summarized=True)
+
+    assert bulk[0]['text'].tolist() == [f"Summary: {CHUNKS[0]}"]
+    assert bulk[1].empty
+    assert bulk[2]['text'].tolist() == [f"Summary: {CHUNKS[2]}"]
+    assert sorted(openai.summarized) == sorted([CHUNKS[0], CHUNKS[2]])
+
+def test_summaries_are_stored_and_reused(api):
+    openai = SummaryChat()
+    texts = [CHUNKS[0], CHUNKS[1], CHUNKS[0]]
+    assert api.summarize_texts(texts, openai=openai, vector_ids=['v1', 'v2', 'v9']) == [f"Summary: {text}" for text in texts]
+    assert sorted(openai.summarized) == sorted(CHUNKS[:2])
+
+    # Both vectors holding the first chunk are recorded under its one summary
+    store = api.summary_store
+    assert all(store.has_vector(vector_id) for vector_id in ['v1', 'v2', 'v9'])
+    assert store.stats()['entries'] == 2
+
+    openai = SummaryChat()
+    bulk = api.fetch_relevant_results_bulk(COURSE, ["What is recursion?"], openai=openai, top_k=1, summarized=True)
+    assert bulk[0]['text'].tolist() == [f"Summary: {CHUNKS[0]}"]
+    assert openai.summarized == []
+
+def test_failed_summaries_are_not_stored(api):
+    class FailingChat(SummaryChat):
+        def generate_summary(self, text):
+            super().generate_summary(text)
+            return None
+
+    assert api.summarize_texts(CHUNKS[:1], openai=FailingChat()) == [None]
+    assert api.summary_store.get(CHUNKS[0]) is None
+
+    openai = SummaryChat()
+    assert api.summarize_texts(CHUNKS[:1], openai=openai) == [f"Summary: {CHUNKS[0]}"]
+    assert openai.summarized == CHUNKS[:1]
+
+def test_bulk_summaries_stay_within_max_workers(api):
+    class SlowChat(SummaryChat):
+        def __init__(self):
+            super().__init__()
+            self.in_flight = 0
+            self.peak = 0
+
+        def generate_summary(self, text):
+            with self.lock:
+                self.in_flight += 1
+                self.peak = max(self.peak, self.in_flight)
+            time.sleep(0.01)
+            with self.lock:
+                self.in_flight -= 1
+            return super().generate_summary(text)
+
+    texts = [f"Recursion fact {index}." for index in range(12)]
+    api.index.write(COURSE, [f"r{index}" for index in range(12)], api.embedder.embed_documents(texts), [{'text': text} for text in texts])
+    openai = SlowChat()
+    queries = [f"recursion question {index}" for index in range(4)]
+    api.fetch_relevant_results_bulk(COURSE, queries, openai=openai, top_k=12, summarized=True, max_workers=2)
+
+    assert len(openai.summarized) == 12
+    assert 1 <= openai.peak <= 2
+
+def test_retrieval_runs_without_api_keys(api, monkeypatch):
+    monkeypatch.delenv('OPENAI_API_KEY', raising=False)
+    monkeypatch.delenv('PINECONE_API_KEY', raising=False)
+
+    df = api.fetch_relevant_results(COURSE, "What is a list?", top_k=1)
+    assert df['text'].tolist() == [CHUNKS[1]]
+    bulk = api.fetch_relevant_results_bulk(COURSE, ["What is a list?", "What is a dict?"], top_k=1)
+    assert [df['text'].tolist() for df in bulk] == [[CHUNKS[1]], [CHUNKS[2]]]
+
+def test_local_index_applies_filter_top_k_and_threshold(api):
+    query = api.embedder.embed_query("dict")
+    matches = api.index.query(query, namespace=COURSE, top_k=3)['matches']
+    assert [match['id'] for match in matches][0] == 'v3'
+    assert matches[0]['score'] == pytest.approx(1.0)
+
+    matches = api.index.query(query, namespace=COURSE, filter={'quiz_id': {'$in': [1]}}, top_k=3)['matches']
+    assert [match['id'] for match in matches] == ['v1']
+
+    df = api.fetch_relevant_results(COURSE, "dict", top_k=3, score_threshold=0.5)
+    assert df['text'].tolist() == [CHUNKS[2]]
+    assert api.index.query(query, namespace='missing')['matches'] == []
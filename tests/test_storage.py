@@ -0,0 +1,60 @@
+import pandas as pd
+
+from conftest import COURSE_ID
+from data_context import FeedbackDataContext
+from storage import ColumnarCache, FeedbackChangeLog, SHEET_NAMES, read_jsonl
+
+def tear(path):
+    """
+    Leaves a half-written last line, as a crash in the middle of a write does.
+    """
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"submission_id": 99, "quiz_id": 1, "feedb')
+
+def test_updates_after_a_torn_line_are_replayed(tmp_path):
+    path = tmp_path / 'feedback.changelog.jsonl'
+    log = FeedbackChangeLog(str(path))
+    log.append(1, 10, 100, "first")
+    log.file.close()
+    tear(path)
+
+    log = FeedbackChangeLog(str(path))
+    log.append(2, 20, 200, "second")
+    log.extend([(3, 30, 300, "third"), (4, 40, 400, None)])
+
+    assert [entry['submission_id'] for entry in log.read()] == [1, 2, 3, 4]
+    assert log.read()[3]['feedback'] is None
+
+def test_unparseable_lines_are_skipped(tmp_path):
+    path = tmp_path / 'log.jsonl'
+    path.write_text('{"a": 1}\nnot json\n{"a": 2}\n', encoding='utf-8')
+    assert read_jsonl(str(path)) == [{'a': 1}, {'a': 2}]
+
+def test_context_replays_the_changelog_after_a_crash(workbook):
+    context = FeedbackDataContext(workbook)
+    pending = context.course_quiz_rows(COURSE_ID)
+    pending = pending.loc[pending['feedback'].isnull(), 'submission_id'].tolist()
+
+    context.update_feedback(pending[0], "before the crash")
+    context.storage.changelog.file.close()
+    tear(context.storage.changelog.path)
+    context = FeedbackDataContext(workbook)
+    context.update_feedback(pending[1], "after the crash")
+
+    # Nothing was compacted: a new process only has the workbook and the changelog
+    context = FeedbackDataContext(workbook)
+    feedback = dict(zip(context.df_quiz['submission_id'], context.df_quiz['feedback']))
+    assert feedback[pending[0]] == "before the crash"
+    assert feedback[pending[1]] == "after the crash"
+
+def test_cache_hit_gives_the_tables_of_a_rebuild(workbook):
+    cache = ColumnarCache(workbook)
+    rebuilt = cache.load()
+    assert not cache.is_stale()
+    cached = cache.load()
+
+    for sheet in SHEET_NAMES:
+        pd.testing.assert_frame_equal(cached[sheet], rebuilt[sheet])
+    # Missing values are NaN on both paths, as read_excel gives them
+    unchecked = cached['quiz_user_past_performance']['unchecked_feedback']
+    assert unchecked.isna().all() and not (unchecked.astype(str) == 'None').any()
@@ -0,0 +1,50 @@
+import pytest
+
+import template
+import template_detail
+from conftest import COURSE_ID, FlakyChat
+from feedback_generator_testing import QuizFeedbackGenerator
+from prompt_renderer import QuizPromptRenderer
+
+INPUTS = [
+    {'current_quiz': "Quiz 1: scored 2 out of 3.", 'past_performance': ""},
+    # Values are inserted as they are, never formatted again
+    {'current_quiz': "Answer: {user_answer} with 100% weight\n\tand a \\ backslash", 'past_performance': "Quiz 0: {} {{}}"},
+]
+
+@pytest.mark.parametrize('module', [template, template_detail])
+@pytest.mark.parametrize('inputs', INPUTS)
+def test_render_matches_prompt_format(module, inputs):
+    compiled = module.get_compiled_template(module.AutomatedFeedbackTemplate)
+    assert compiled.render_text is not None
+    assert compiled.render(**inputs) == compiled.prompt.format(**inputs)
+
+def test_render_falls_back_to_the_prompt():
+    compiled = template_detail.BaseTemplate(template_text="{current_quiz} {{literal}}")
+    compiled.build()
+    compiled.render_text = None
+    assert compiled.render(current_quiz="x") == compiled.prompt.format(current_quiz="x")
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_prompts_of_a_course_match_prompt_format(context, compact):
+    qfg = QuizFeedbackGenerator(COURSE_ID, context=context, openai=FlakyChat())
+    qfg.compact_past_performance = compact
+    qfg.get_quiz_to_update(limit=None)
+    qfg.get_details_to_generate_feedback()
+    prompt = template_detail.get_compiled_template(template_detail.AutomatedFeedbackTemplate).prompt
+    renderer = QuizPromptRenderer()
+
+    prompts = qfg.build_prompts()
+    assert len(prompts) == 16
+    for quiz in qfg.to_update_feedback_quizzes:
+        submission_id = quiz['submission_id']
+        if compact:
+            summary = context.performance_summary.summarize(quiz['course_id'], quiz['user_id'], quiz['due_date'])
+            past_performance = renderer.render_performance_summary(summary)
+        else:
+            past_performance = renderer.render_past_performance(qfg.users_past_performance.get(submission_id))
+        inputs = {
+            'current_quiz': renderer.render_current_quiz(quiz, qfg.to_update_quiz_details[submission_id]),
+            'past_performance': past_performance,
+        }
+        assert prompts[submission_id] == prompt.format(**inputs)
@@ -0,0 +1,85 @@
+import httpx
+import pytest
+from openai import APITimeoutError, AuthenticationError, RateLimitError
+
+from benchmark import FakeChatClient
+from metrics import METRICS
+from utils import OpenAIChatResponse, RateLimiter, get_retry_after
+
+REQUEST = httpx.Request('POST', 'https://api.openai.com/v1/chat/completions')
+
+def rate_limit_error(headers: dict = None) -> RateLimitError:
+    response = httpx.Response(429, request=REQUEST, headers=headers or {})
+    return RateLimitError("Rate limit reached", response=response, body=None)
+
+class FailingClient(FakeChatClient):
+
+    def __init__(self, errors: list):
+        """
+        FakeChatClient that raises the given errors, one per request, before answering.
+        """
+        super().__init__(latency=0)
+        self.errors = list(errors)
+
+    def create(self, messages, model, max_tokens, **kwargs):
+        if self.errors:
+            with self.lock:
+                self.requests += 1
+            raise self.errors.pop(0)
+        return super().create(messages, model, max_tokens, **kwargs)
+
+def chat(errors: list, **kwargs) -> OpenAIChatResponse:
+    openai = OpenAIChatResponse(api_key='test', backoff=0, **kwargs)
+    openai.client = FailingClient(errors)
+    return openai
+
+def test_retryable_errors_are_retried():
+    openai = chat([rate_limit_error(), APITimeoutError(request=REQUEST)], max_retries=2)
+
+    response = openai.generate_response("prompt")
+
+    assert response.startswith("Feedback: Overall")
+    assert openai.client.requests == 3
+    counters = METRICS.summary()['counters']
+    assert counters['llm_retries'] == 2
+    assert counters['llm_throttled'] == 1
+    assert 'llm_errors' not in counters
+
+def test_exhausted_retries_return_none_and_count_the_error():
+    openai = chat([rate_limit_error()] * 3, max_retries=2)
+
+    assert openai.generate_response("prompt") is None
+    assert openai.client.requests == 3
+    assert METRICS.summary()['counters']['llm_errors'] == 1
+
+def test_other_errors_are_not_retried():
+    response = httpx.Response(401, request=REQUEST)
+    openai = chat([AuthenticationError("Invalid key", response=response, body=None)], max_retries=3)
+
+    with pytest.raises(AuthenticationError):
+        openai.complete("prompt", "gpt-3.5-turbo", 100)
+    assert openai.client.requests == 1
+
+def test_retry_after_headers():
+    assert get_retry_after(rate_limit_error({'retry-after-ms': '250'})) == 0.25
+    assert get_retry_after(rate_limit_error({'retry-after': '2'})) == 2.0
+    assert get_retry_after(rate_limit_error()) is None
+
+def test_rate_limiter_adapts_concurrency():
+    limiter = RateLimiter(max_concurrency=4)
+    limiter.acquire()
+    limiter.release(throttled=True)
+    assert limiter.concurrency == 2
+
+    for _ in range(2):
+        limiter.acquire()
+        limiter.release()
+    assert limiter.concurrency == 3
+
+def test_request_budget_delays_requests():
+    limiter = RateLimiter(requests_per_minute=2)
+    limiter.acquire()
+    limiter.release()
+    limiter.acquire()
+    limiter.release()
+    assert limiter.wait_time(0, limiter.window[0][0]) == pytest.approx(60)
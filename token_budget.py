@@ -0,0 +1,150 @@
+from typing import Callable, List, Tuple
+from metrics import METRICS
+import threading
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+_encodings = {}  # model -> tiktoken encoding, or None when it could not be loaded
+_encodings_lock = threading.Lock()
+
+def get_encoding(model: str):
+    """
+    Loads the tiktoken encoding of a model once per process. The encoding files are downloaded
+    on first use, so offline the failure is reported once and tokens are estimated instead.
+
+    :param model: The model whose tokenizer is used.
+    :return: The encoding, or None if tiktoken is not installed or the encoding could not be loaded.
+    """
+    if tiktoken is None:
+        return None
+    with _encodings_lock:
+        if model not in _encodings:
+            try:
+                try:
+                    _encodings[model] = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    _encodings[model] = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                _encodings[model] = None
+                METRICS.report(f"Could not load the tiktoken encoding, estimating tokens instead: {e}",
+                               event='tokenizer_unavailable', model=model, error=str(e))
+        return _encodings[model]
+
+class TokenCounter:
+
+    def __init__(self, model: str = "gpt-3.5-turbo"):
+        """
+        Counts prompt tokens with tiktoken when it is installed and its encoding can be loaded,
+        and otherwise estimates them offline at four characters per token.
+
+        :param model: The model whose tokenizer is used.
+        """
+        self.model = model
+        self.encoding = get_encoding(model)
+
+    def count(self, text: str) -> int:
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return (len(text) + 3) // 4
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """
+        Shortens a text to at most max_tokens tokens, marking the cut with "...".
+        """
+        text = str(text)
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            if len(tokens) <= max_tokens:
+                return text
+            return self.encoding.decode(tokens[:max_tokens]) + "..."
+        if len(text) <= max_tokens * 4:
+            return text
+        return text[:max_tokens * 4] + "..."
+
+class PromptBudget:
+
+    def __init__(self, max_prompt_tokens: int = None, past_feedback_tokens: int = 300, text_tokens: int = 100, counter: TokenCounter = None):
+        """
+        Budget policy for rendered prompts. A prompt over max_prompt_tokens is shrunk in steps until it fits:
+        past feedback is shortened, then the oldest past quizzes (or feedback digests of a compact summary) are
+        dropped, then question and answer texts are shortened.
+
+        :param max_prompt_tokens: Target size of a prompt in tokens. None only counts tokens.
+        :param past_feedback_tokens: Size each past feedback is shortened to.
+        :param text_tokens: Size each question and answer text is shortened to.
+        :param counter: Token counter to use. Defaults to a TokenCounter for gpt-3.5-turbo.
+        """
+        self.max_prompt_tokens = max_prompt_tokens
+        self.past_feedback_tokens = past_feedback_tokens
+        self.text_tokens = text_tokens
+        self.counter = counter if counter is not None else TokenCounter()
+
+    def fit(self, prompt: str, questions: list, past_quizzes: list, render: Callable[[list, list], str]) -> Tuple[str, int, bool]:
+        """
+        :param prompt: The prompt rendered from the full inputs.
+        :param questions: Combined list of questions with user answers of the submission.
+        :param past_quizzes: Past quiz records, or feedback digests, of the user, latest first.
+        :param render: Renders a prompt from (questions, past_quizzes).
+        :return: The prompt, its size in tokens and whether it was trimmed.
+        """
+        tokens = self.counter.count(prompt)
+        if self.max_prompt_tokens is None or tokens <= self.max_prompt_tokens:
+            return prompt, tokens, False
+
+        past_quizzes = past_quizzes or []
+        shortened = [
+            dict(quiz, feedback=self.counter.truncate(quiz['feedback'], self.past_feedback_tokens))
+            for quiz in past_quizzes
+        ]
+        if shortened != past_quizzes:  # Short feedback, e.g. summary digests, leaves the prompt as it is
+            past_quizzes = shortened
+            prompt, tokens = self.measure(render, questions, past_quizzes)
+
+        while past_quizzes and tokens > self.max_prompt_tokens:
+            past_quizzes = past_quizzes[:-1]
+            prompt, tokens = self.measure(render, questions, past_quizzes)
+
+        if tokens > self.max_prompt_tokens:
+            questions = [self.truncate_question(question) for question in questions]
+            prompt, tokens = self.measure(render, questions, past_quizzes)
+
+        return prompt, tokens, True
+
+    def measure(self, render: Callable[[list, list], str], questions: list, past_quizzes: list) -> Tuple[str, int]:
+        prompt = render(questions, past_quizzes)
+        return prompt, self.counter.count(prompt)
+
+    def truncate_question(self, question: dict) -> dict:
+        # Copies, since answer choice lists are shared between submissions of a quiz
+        return dict(
+            question,
+            question_text=self.counter.truncate(question['question_text'], self.text_tokens),
+            answer_choices=[
+                dict(answer, answer_text=self.counter.truncate(answer['answer_text'], self.text_tokens))
+                for answer in question['answer_choices']
+            ],
+        )
+
+def summarize_token_usage(prompt_tokens: dict, trimmed: List, max_token: int, max_prompt_tokens: int = None) -> dict:
+    """
+    Totals the prompt sizes of a batch to forecast its cost.
+
+    :param prompt_tokens: Dictionary of submission ID to prompt tokens.
+    :param trimmed: Submission IDs whose prompts were trimmed to fit the budget.
+    :param max_token: Maximum completion tokens requested per prompt.
+    :param max_prompt_tokens: Token budget of a prompt, to count prompts that are still over it.
+    :return: Dictionary with the batch totals.
+    """
+    sizes = list(prompt_tokens.values())
+    return {
+        'prompts': len(sizes),
+        'prompt_tokens': sum(sizes),
+        'max_prompt_tokens': max(sizes) if sizes else 0,
+        'mean_prompt_tokens': sum(sizes) / len(sizes) if sizes else 0,
+        'trimmed_prompts': len(trimmed),
+        'over_budget_prompts': sum(size > max_prompt_tokens for size in sizes) if max_prompt_tokens else 0,
+        'max_completion_tokens': max_token * len(sizes),
+    }
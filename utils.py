@@ -1,45 +1,213 @@
-from openai import OpenAI
+from openai import OpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+from collections import deque
+from response_cache import ResponseCache
+from metrics import METRICS
 import os
+import random
+import threading
+import time
+
+RETRYABLE_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+
+class RateLimiter:
+
+    def __init__(self, requests_per_minute: int = None, tokens_per_minute: int = None, max_concurrency: int = 8, min_concurrency: int = 1):
+        """
+        Client-side limiter that keeps requests within per-minute request and token budgets
+        and adapts the number of requests in flight to the throttling observed from the provider.
+
+        :param requests_per_minute: Maximum number of requests started in any 60 second window.
+        :param tokens_per_minute: Maximum number of (estimated) tokens sent in any 60 second window.
+        :param max_concurrency: Upper bound for the number of requests in flight.
+        :param min_concurrency: Lower bound the concurrency is reduced to when throttled.
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+
+        self.concurrency = max_concurrency
+        self.in_flight = 0
+        self.successes = 0
+        self.blocked_until = 0.0
+        self.window = deque()  # (start time, tokens) of the requests of the last minute
+        self.condition = threading.Condition()
+
+    def wait_time(self, tokens: int, now: float) -> float:
+        while self.window and now - self.window[0][0] >= 60:
+            self.window.popleft()
+
+        wait = max(0.0, self.blocked_until - now)
+        if self.requests_per_minute and len(self.window) >= self.requests_per_minute:
+            wait = max(wait, 60 - (now - self.window[0][0]))
+        if self.tokens_per_minute and self.window:
+            used = sum(window_tokens for _, window_tokens in self.window)
+            for start, window_tokens in self.window:
+                if used + tokens <= self.tokens_per_minute:
+                    break
+                used -= window_tokens
+                wait = max(wait, 60 - (now - start))
+        return wait
+
+    def acquire(self, tokens: int = 0):
+        """
+        Blocks until a request of the given size fits in the budgets and a concurrency slot is free.
+
+        :param tokens: Estimated tokens of the request.
+        """
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                wait = self.wait_time(tokens, now)
+                if wait <= 0 and self.in_flight < self.concurrency:
+                    self.window.append((now, tokens))
+                    self.in_flight += 1
+                    return
+                self.condition.wait(timeout=wait if wait > 0 else None)
+
+    def release(self, throttled: bool = False, retry_after: float = None):
+        """
+        Frees the slot of a finished request and adapts the concurrency: it is halved when the
+        request was throttled and grows by one after a full round of successful requests.
+
+        :param throttled: Whether the provider rejected the request with a rate limit.
+        :param retry_after: Seconds the provider asked to wait before the next request.
+        """
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.successes = 0
+                self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+                if retry_after:
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            else:
+                self.successes += 1
+                if self.successes >= self.concurrency and self.concurrency < self.max_concurrency:
+                    self.concurrency += 1
+                    self.successes = 0
+            self.condition.notify_all()
+
+def get_retry_after(error: Exception) -> float:
+    """
+    Reads the Retry-After hint of a failed request, if the provider sent one.
+
+    :param error: The exception raised by the OpenAI client.
+    :return: Seconds to wait, or None.
+    """
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except ValueError:
+        return None
+    return None
 
 class OpenAIChatResponse:
-    def __init__(self, **kwargs):
+    def __init__(self, rate_limiter: RateLimiter = None, max_retries: int = 5, backoff: float = 1.0, max_backoff: float = 60.0, cache: ResponseCache = None, **kwargs):
+        """
+        :param rate_limiter: Optional limiter shared by all requests of this client.
+        :param max_retries: Number of retries for rate limited, timed out or failed requests.
+        :param backoff: Base delay in seconds of the exponential backoff.
+        :param max_backoff: Upper bound of a single backoff delay in seconds.
+        :param cache: Optional response cache consulted before any request is sent.
+        :param kwargs: Passed to the OpenAI client, e.g. base_url to point it at another chat-completions server.
+        """
         self.openai_api_key = os.environ.get("OPENAI_API_KEY")
-        self.client = OpenAI()
-    
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.cache = cache
+        kwargs.setdefault('max_retries', 0)  # Retries are handled by complete()
+        self.client = OpenAI(**kwargs)
+
+    def complete(self, query: str, model: str, max_token: int) -> str:
+        """
+        Sends a single-message chat completion, retrying retryable errors with exponential backoff and jitter.
+        Responses found in the cache are returned without touching the network.
+
+        :param query: The user message.
+        :param model: The model name.
+        :param max_token: Maximum number of tokens to generate.
+        :return: The response text.
+        """
+        if self.cache:
+            cached = self.cache.get(model, max_token, query)
+            if cached is not None:
+                METRICS.increment('llm_cache_hits')
+                return cached
+
+        estimated_tokens = len(query) // 4 + max_token
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter:
+                self.rate_limiter.acquire(estimated_tokens)
+            throttled, retry_after = False, None
+            if attempt:
+                METRICS.increment('llm_retries')
+            METRICS.increment('llm_requests')
+            start = time.perf_counter()
+            try:
+                chat_completion = self.client.chat.completions.create(
+                    messages=[
+                        {
+                            "role": "user",
+                            "content": query,
+                        }
+                    ],
+                    model=model,
+                    max_tokens=max_token,
+                )
+                METRICS.observe('llm_call', time.perf_counter() - start, 1)
+                usage = getattr(chat_completion, 'usage', None)
+                if usage is not None:
+                    METRICS.increment('prompt_tokens', usage.prompt_tokens or 0)
+                    METRICS.increment('completion_tokens', usage.completion_tokens or 0)
+                response = chat_completion.choices[0].message.content
+                if self.cache and response is not None:
+                    self.cache.set(model, max_token, query, response)
+                return response
+            except RETRYABLE_ERRORS as e:
+                METRICS.observe('llm_call', time.perf_counter() - start)
+                throttled = isinstance(e, RateLimitError)
+                if throttled:
+                    METRICS.increment('llm_throttled')
+                retry_after = get_retry_after(e)
+                if attempt == self.max_retries:
+                    raise
+            finally:
+                if self.rate_limiter:
+                    self.rate_limiter.release(throttled=throttled, retry_after=retry_after)
+
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+            time.sleep(max(delay, retry_after or 0))
+
     def generate_response(self, query:str, model:str = "gpt-3.5-turbo", max_token:int = 4000):
+        """
+        Same as complete, for callers that handle failures themselves.
+
+        :return: The response text, or None if the request failed after its retries. None marks a
+            failure and must not be stored as feedback; it is counted as llm_errors.
+        """
         try:
-            chat_completion = self.client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "user",
-                        "content": query,
-                    }
-                ],
-                model=model,
-                max_tokens=max_token,
-            )
-            return chat_completion.choices[0].message.content
-        except:
-            print('Error generating response')
+            return self.complete(query, model, max_token)
+        except Exception as e:
+            METRICS.increment('llm_errors')
+            METRICS.report(f'Error generating response: {e}', event='llm_error', error=str(e))
             return None
-    
+
     def generate_summary(self, text:str, model:str = "gpt-3.5-turbo", max_token:int = 4000):
 
         query = f"""
                     Please generate a detailed summary of the following text: {text}
                 """
         try:
-            chat_completion = self.client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "user",
-                        "content": query,
-                    }
-                ],
-                model=model,
-                max_tokens=max_token,
-            )
-            return chat_completion.choices[0].message.content
-        except:
-            print('Error generating response')
-            return None
\ No newline at end of file
+            return self.complete(query, model, max_token)
+        except Exception as e:
+            METRICS.increment('llm_errors')
+            METRICS.report(f'Error generating response: {e}', event='llm_error', error=str(e))
+            return None